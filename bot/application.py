@@ -1,52 +1,71 @@
+import asyncio
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from bot.handlers.start import start
 from bot.handlers.docs import docs
 from bot.handlers.chat import chat
 from bot.handlers.other import handle_other
+from bot.persistence import create_persistence
+from bot.update_processor import ChatOrderedUpdateProcessor
+from bot.throttle import MessageThrottle
+from services.metrics import track_handler
+from config import settings
 from utils.logger import setup_logger
 
 logger = setup_logger()
 
+# Кнопки основного меню
+MENU_BUTTONS = filters.TEXT & (
+    filters.Regex(r"^(📄 Документы|📝 Бизнес-план|📊 Финансовая модель|💬 Задать вопрос)$") |
+    filters.Regex(r"^(Документы|Бизнес-план|Финансовая модель|Задать вопрос)$")
+)
+# Кнопки с документами (начинающиеся с 📎)
+DOCUMENT_BUTTONS = filters.TEXT & filters.Regex(r"^📎 ")
+# Сообщения, которые уходят в LLM: внутри чата они обрабатываются по очереди
+CHAT_MESSAGES = filters.TEXT & ~filters.COMMAND & ~MENU_BUTTONS & ~DOCUMENT_BUTTONS
+
 def create_application(token: str):
     # Создаем приложение
-    application = Application.builder().token(token).build()
+    builder = Application.builder().token(token)
+    # user_data и chat_data переживают перезапуск; данные чата читаются при первом обращении
+    persistence = create_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    # Слишком частые вопросы пользователя склеиваются и возвращаются в общую очередь обновлений
+    update_queue = asyncio.Queue()
+    builder = builder.update_queue(update_queue)
+    throttle = MessageThrottle(update_queue)
+    # Разные чаты обрабатываются параллельно; медленный ответ LLM не задерживает остальных
+    builder = builder.concurrent_updates(
+        ChatOrderedUpdateProcessor(settings.max_concurrent_updates, CHAT_MESSAGES, gate=throttle)
+    )
+    application = builder.build()
+    # main() отправляет накопленные сообщения перед остановкой приложения
+    application.bot_data["throttle"] = throttle
 
     # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("docs", docs))
+    application.add_handler(CommandHandler("start", track_handler("start", start)))
+    application.add_handler(CommandHandler("docs", track_handler("docs", docs)))
 
     # Обработчик для кнопок меню
     application.add_handler(
-        MessageHandler(
-            filters.TEXT & (
-                filters.Regex(r"^(📄 Документы|📝 Бизнес-план|📊 Финансовая модель|💬 Задать вопрос)$") |
-                filters.Regex(r"^(Документы|Бизнес-план|Финансовая модель|Задать вопрос)$")
-            ),
-            docs
-        )
+        MessageHandler(MENU_BUTTONS, track_handler("docs", docs))
     )
 
     # Обработчик для кнопок с документами (начинающихся с 📎)
     application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.Regex(r"^📎 "),
-            docs
-        )
+        MessageHandler(DOCUMENT_BUTTONS, track_handler("docs", docs))
     )
 
     # Обработчик для обычных текстовых сообщений
     application.add_handler(
-        MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            chat
-        )
+        MessageHandler(CHAT_MESSAGES, track_handler("chat", chat))
     )
 
     # Обработчик для всех остальных типов сообщений
     application.add_handler(
         MessageHandler(
             filters.ALL,
-            handle_other
+            track_handler("handle_other", handle_other)
         )
     )
 
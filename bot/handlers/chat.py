@@ -1,28 +1,143 @@
 from telegram import Update, ReplyKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
-from services.llm import YandexLLM
-from services.history import load_history, save_history
-from services.cache import cache
-from utils.helpers import get_cache_key
+from services.llm import YandexLLM, LLMError
+from services.history import load_history, history_writer
+from services.cache import cache, faq_cache
+from services.semantic_cache import semantic_cache
+from services.singleflight import llm_singleflight
+from services.summarizer import summarizer
+from services.state_backend import state_backend
+from bot.throttle import backlog, is_overloaded
+from utils.helpers import get_cache_key, get_faq_cache_key, is_context_free
 from config import settings
-import logging
+from utils.logger import setup_logger
+from typing import List, Optional
 import asyncio
 
-logger = logging.getLogger(__name__)
+logger = setup_logger()
 
-from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes
-from services.llm import YandexLLM
-from services.history import load_history, save_history
-from services.cache import cache
-from utils.helpers import get_cache_key
-from config import settings
-import logging
-import asyncio
+# Текст, который видит пользователь, пока ответ еще не начал генерироваться
+STREAM_PLACEHOLDER = "✍️ Готовлю ответ..."
+# Ответ при перегрузке, если вопроса нет в кэше
+BUSY_MESSAGE = "Сейчас много обращений. Пожалуйста, повторите вопрос через минуту."
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбить ответ на сообщения Telegram: по последнему переносу строки или пробелу перед лимитом"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return [part for part in parts if part]
+
+async def reply_long(message, text: str):
+    """Ответить текстом любой длины, при необходимости несколькими сообщениями"""
+    for part in split_message(text):
+        await message.reply_text(part)
 
-logger = logging.getLogger(__name__)
+async def _edit_message(message, text: str, final: bool = False) -> bool:
+    """
+    Отредактировать сообщение; промежуточные правки при ограничениях Telegram пропускаются.
+    Показывается не больше TELEGRAM_MESSAGE_LIMIT символов: продолжение отправляет _finish_stream.
+    """
+    try:
+        await message.edit_text(text[:TELEGRAM_MESSAGE_LIMIT])
+        return True
+    except RetryAfter as e:
+        if not final:
+            return False
+        await asyncio.sleep(e.retry_after)
+        return await _edit_message(message, text, final=True)
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return True
+        logger.warning(f"⚠️ Не удалось обновить сообщение: {e}")
+        return False
+
+async def _finish_stream(update: Update, message, text: str, shown: str):
+    """Показать итоговый текст: начало — в потоковом сообщении, продолжение — новыми сообщениями"""
+    first, *rest = split_message(text) or [text]
+    if first != shown:
+        await _edit_message(message, first, final=True)
+    for part in rest:
+        await update.message.reply_text(part)
+
+async def stream_reply(update: Update, chunks) -> Optional[str]:
+    """
+    Отправляет ответ по мере генерации: сначала заглушка, затем правки
+    не чаще раза в stream_edit_interval секунд. Возвращает итоговый текст.
+    """
+    message = await update.message.reply_text(STREAM_PLACEHOLDER)
+    loop = asyncio.get_running_loop()
+    text = ""
+    shown = ""
+    last_edit = loop.time()
+
+    try:
+        async for text in chunks:
+            now = loop.time()
+            if text.strip() and text != shown and now - last_edit >= settings.stream_edit_interval:
+                if await _edit_message(message, text):
+                    shown = text
+                last_edit = now
+    except Exception as e:
+        if not isinstance(e, LLMError):
+            logger.error(f"Ошибка при потоковом запросе к LLM: {e}", exc_info=True)
+        # Оборванный ответ не кэшируется и не попадает в историю
+        if text.strip():
+            await _finish_stream(update, message, text.strip() + " …", shown)
+        else:
+            error_text = e.user_message if isinstance(e, LLMError) else "Извините, произошла ошибка при генерации ответа."
+            await _edit_message(message, error_text, final=True)
+        return None
+
+    text = text.strip()
+    if not text:
+        await _edit_message(message, "Извините, произошла ошибка при генерации ответа.", final=True)
+        return None
+    await _finish_stream(update, message, text, shown)
+    return text
+
+def _add_turn(chat_id: int, chat_data: dict, user_message: str, response: str, prompt_type: str, api_client):
+    """Дописать пару вопрос-ответ в историю, запустить ее сжатие и ограничить размер истории в памяти"""
+    history = chat_data["history"]
+    history.append({"role": "user", "content": user_message})
+    history.append({"role": "assistant", "content": response})
+    # Асинхронно дописываем пару в файл истории
+    history_writer.append_turn(chat_id, user_message, response, prompt_type)
+    # Длинную историю сворачиваем в сводку в фоне. Сжатие запускается до обрезки, а порог сжатия
+    # меньше max_history_pairs (см. Settings.is_valid), поэтому обрезка не отбрасывает несжатые пары
+    summarizer.maybe_schedule(chat_id, chat_data, api_client)
+
+    # Ограничиваем размер истории в памяти; в запрос она отбирается по бюджету токенов
+    max_len = settings.max_history_pairs * 2 + 1  # +1 для системного промпта
+    if len(history) > max_len:
+        # Сохраняем системный промпт, сводку разговора и последние сообщения
+        system_prompt = history[0]
+        summary = [msg for msg in history if msg["role"] == "summary"]
+        recent = [msg for msg in history if msg["role"] in ("user", "assistant")][-max_len+1:]
+        chat_data["history"] = [system_prompt] + summary + recent
 
 async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Сообщения одного чата обрабатываются по очереди, в том числе разными процессами
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    async with state_backend.lock(f"chat:{chat_id}") as acquired:
+        if not acquired:
+            # Без блокировки ответ перепутал бы историю и кэш с обрабатываемым сейчас сообщением
+            if update.message:
+                await update.message.reply_text(BUSY_MESSAGE)
+            return
+        await _chat(update, context)
+        await history_writer.commit(chat_id)
+
+async def _chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         logger.warning("Пустое сообщение или отсутствует текст")
         return
@@ -32,13 +147,15 @@ async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning("Пустое сообщение после очистки")
         return
 
-    logger.info(f"Получено сообщение: {user_message}")
+    # Одной строкой: по этим строкам логов обучается модель интентов (train_intent_classifier.py)
+    logger.info(f"Получено сообщение: {' '.join(user_message.split())}")
 
     # ... остальной код без изменений ...
     # Проверяем, не является ли сообщение командой смены контекста
     if user_message.lower() in ["сменить контекст", "другой вопрос", "новый вопрос"]:
         if "history" in context.chat_data:
             del context.chat_data["history"]
+        history_writer.append_reset(update.effective_chat.id)
         if "selected_prompt" in context.user_data:
             del context.user_data["selected_prompt"]
         if "prompt_confirmed" in context.user_data:
@@ -60,7 +177,8 @@ async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     llm_service = context.application.bot_data["llm_service"]
-    prompt_type = llm_service.determine_intent(user_message)
+    # Неуверенно распознанное сообщение остается в интенте, выбранном ранее
+    prompt_type = llm_service.determine_intent(user_message, context.user_data.get("selected_prompt"))
     
     # Сохраняем выбранный промпт в user_data для последующего использования
     context.user_data["selected_prompt"] = prompt_type
@@ -83,59 +201,96 @@ async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Работа с историей
     chat_id = update.effective_chat.id
-    if "history" not in context.chat_data:
-        loaded_history = await load_history(chat_id)
-        sys_prompt = llm_service.select_prompt(prompt_type)
-        # Добавляем системный промпт только если его еще нет в истории
-        if not any(msg.get("role") == "system" for msg in loaded_history):
-            loaded_history.insert(0, {"role": "system", "content": sys_prompt})
-        context.chat_data["history"] = loaded_history
+    # При общем бэкенде сообщения чата мог обработать другой процесс: история в памяти устарела
+    if state_backend.shared or "history" not in context.chat_data:
+        context.chat_data["history"] = await load_history(chat_id, settings.max_history_pairs)
 
     history = context.chat_data["history"]
-    
-    # Обновляем системный промпт если он изменился
-    current_sys_prompt = llm_service.select_prompt(prompt_type)
+
+    # Обновляем системный промпт, только если сменилась его версия
+    prompt = llm_service.get_prompt(prompt_type)
+    system_message = {"role": "system", "content": prompt.text, "version": prompt.version}
     if history and history[0].get("role") == "system":
-        history[0]["content"] = current_sys_prompt
+        if history[0].get("version") != prompt.version:
+            history[0] = system_message
     else:
-        history.insert(0, {"role": "system", "content": current_sys_prompt})
+        history.insert(0, system_message)
+
+    # Проверяем кэш: сначала точный ключ, затем FAQ-кэш для вопросов без контекста
+    cache_key = get_cache_key(user_message, history, prompt.version) if settings.use_cache else None
+    faq_key = None
+    if settings.use_cache and settings.use_faq_cache and is_context_free(user_message, history):
+        faq_key = get_faq_cache_key(user_message, prompt_type)
+
+    cached = await cache.get(cache_key) if cache_key else None
+    if not cached and faq_key:
+        cached = await faq_cache.get(faq_key)
+        if cached:
+            logger.info(f"✅ Ответ найден в FAQ-кэше ({prompt_type})")
+
+    # Перефразированные вопросы без контекста ищем в семантическом кэше
+    question_vector = None
+    if not cached and faq_key and semantic_cache.enabled:
+        question_vector = await semantic_cache.embed(user_message)
+        cached = semantic_cache.lookup(prompt_type, user_message, question_vector)
 
-    # Проверяем кэш
-    cache_key = get_cache_key(user_message, history)
-    if cache_key and (cached := await cache.get(cache_key)):
+    if cached:
         response = cached
-        history.append({"role": "user", "content": user_message})
-        history.append({"role": "assistant", "content": response})
-        
-        # Сохраняем историю асинхронно без блокировки
-        asyncio.create_task(save_history(chat_id, history))
-        
-        await update.message.reply_text(response)
+        _add_turn(chat_id, context.chat_data, user_message, response, prompt_type, llm_service.api_client)
+        await reply_long(update.message, response)
+        return
+
+    # При перегрузке отвечаем только из кэша, чтобы очередь к LLM не росла дальше
+    if is_overloaded(context.application, llm_service.api_client):
+        logger.warning(f"⚠️ В очереди {backlog(context.application, llm_service.api_client)} вопросов, вопрос отклонен")
+        await update.message.reply_text(BUSY_MESSAGE)
         return
 
     # Делаем запрос к LLM
+    streaming = settings.llm_streaming
+
+    async def generate() -> Optional[str]:
+        if streaming:
+            return await stream_reply(
+                update, llm_service.chat_stream(user_message, history, prompt_type, user_key=chat_id)
+            )
+        return await llm_service.chat(user_message, history, prompt_type, user_key=chat_id)
+
+    # Одинаковые вопросы, заданные одновременно, ждут один общий запрос
+    flight_key = faq_key or cache_key
+    shared = False
     try:
-        response = await llm_service.chat(user_message, history, prompt_type)
+        if flight_key:
+            response, shared = await llm_singleflight.do(flight_key, generate)
+        else:
+            response = await generate()
+    except LLMError as e:
+        # Текст ошибки показываем пользователю, но не сохраняем в кэш и историю
+        await update.message.reply_text(e.user_message)
+        return
     except Exception as e:
         logger.error(f"Ошибка при запросе к LLM: {e}", exc_info=True)
         await update.message.reply_text("Извините, произошла ошибка при генерации ответа.")
         return
 
-    # Обновляем историю
-    history.append({"role": "user", "content": user_message})
-    history.append({"role": "assistant", "content": response})
-
-    # Ограничиваем размер истории
-    max_len = settings.max_history_pairs * 2 + 1  # +1 для системного промпта
-    if len(history) > max_len:
-        # Сохраняем системный промпт и последние сообщения
-        system_prompt = history[0]
-        recent = [msg for msg in history if msg["role"] in ("user", "assistant")][-max_len+1:]
-        context.chat_data["history"] = [system_prompt] + recent
+    if response is None:
+        # Ошибка уже показана пользователю в потоковом сообщении
+        if shared:
+            await update.message.reply_text("Извините, произошла ошибка при генерации ответа.")
+        return
+    if shared:
+        logger.info(f"🔗 Ответ получен из одновременного запроса ({prompt_type})")
 
-    # Асинхронно сохраняем историю и кэш
-    asyncio.create_task(save_history(chat_id, context.chat_data["history"]))
+    # Обновляем историю и асинхронно сохраняем ее и кэш
+    _add_turn(chat_id, context.chat_data, user_message, response, prompt_type, llm_service.api_client)
     if cache_key:
         asyncio.create_task(cache.set(cache_key, response))
+    # Общий ответ уже сохранен в FAQ- и семантический кэш первым запросом
+    if faq_key and not shared:
+        asyncio.create_task(faq_cache.set(faq_key, response))
+    if not shared:
+        semantic_cache.add(prompt_type, user_message, question_vector, response)
 
-    await update.message.reply_text(response)
\ No newline at end of file
+    # При потоковом режиме ответ уже показан пользователю, если запрос был свой
+    if not streaming or shared:
+        await reply_long(update.message, response)
\ No newline at end of file
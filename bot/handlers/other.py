@@ -1,8 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-import logging
+from utils.logger import setup_logger
 
-logger = logging.getLogger(__name__)
+logger = setup_logger()
 
 async def handle_other(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик для неподдерживаемых типов сообщений"""
@@ -1,15 +1,10 @@
 # bot/handlers/start.py
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
+from bot.handlers.docs import create_main_keyboard
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        ["📄 Документы", "💬 Задать вопрос"],
-        ["📝 Бизнес-план", "📊 Финансовая модель"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
     await update.message.reply_text(
         "🏡 Добро пожаловать в проект *«Усадьба»*!\n\n"
         "Я — ваш цифровой помощник. Могу:\n"
@@ -17,6 +12,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• 💬 Ответить на вопросы о проекте\n"
         "• 📊 Показать финансовую модель\n\n"
         "Выберите действие:",
-        reply_markup=reply_markup,
+        reply_markup=create_main_keyboard(),
         parse_mode="Markdown"
     )
\ No newline at end of file
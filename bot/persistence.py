@@ -0,0 +1,266 @@
+import os
+import json
+import sqlite3
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from telegram.ext import BasePersistence, PersistenceInput
+from config import settings
+from services.state_backend import StateBackend, state_backend
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Ключи, которые уже хранятся в другом месте и не сохраняются повторно
+TRANSIENT_KEYS = {"history"}
+
+# (вид данных, id); вид — "user" или "chat". В пачке записи None означает удаление
+StateKey = Tuple[str, int]
+
+class PersistenceStore(ABC):
+    """Хранилище данных пользователей и чатов: точечное чтение и пакетная запись.
+
+    `shared` — пишут ли в хранилище и другие процессы бота.
+    """
+
+    shared = False
+
+    @abstractmethod
+    async def get(self, kind: str, item_id: int) -> Optional[str]:
+        """Сохраненные данные в JSON или None"""
+
+    @abstractmethod
+    async def write(self, batch: Dict[StateKey, Optional[str]]):
+        """Записать пачку; None в пачке означает удаление"""
+
+    async def close(self):
+        pass
+
+class SQLitePersistenceStore(PersistenceStore):
+    """Данные в SQLite: одна строка на пользователя или чат, запись пачки — одна транзакция"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-persistence")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS state "
+                "(kind TEXT NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (kind, id)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _get_sync(self, kind: str, item_id: int) -> Optional[str]:
+        row = self._connect().execute("SELECT data FROM state WHERE kind = ? AND id = ?", (kind, item_id)).fetchone()
+        return row[0] if row else None
+
+    def _write_sync(self, batch: Dict[StateKey, Optional[str]]):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO state (kind, id, data) VALUES (?, ?, ?)",
+                [(kind, item_id, data) for (kind, item_id), data in batch.items() if data is not None]
+            )
+            conn.executemany(
+                "DELETE FROM state WHERE kind = ? AND id = ?",
+                [(kind, item_id) for (kind, item_id), data in batch.items() if data is None]
+            )
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def get(self, kind: str, item_id: int) -> Optional[str]:
+        return await self._run(self._get_sync, kind, item_id)
+
+    async def write(self, batch: Dict[StateKey, Optional[str]]):
+        await self._run(self._write_sync, batch)
+
+    async def close(self):
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=True)
+
+class BackendPersistenceStore(PersistenceStore):
+    """Данные в общем бэкенде состояния (Redis), чтобы их видели все процессы бота"""
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+        self.shared = backend.shared
+
+    @staticmethod
+    def _key(kind: str, item_id: int) -> str:
+        return f"{kind}_data:{item_id}"
+
+    async def get(self, kind: str, item_id: int) -> Optional[str]:
+        return await self.backend.get(self._key(kind, item_id))
+
+    async def write(self, batch: Dict[StateKey, Optional[str]]):
+        deleted = [self._key(kind, item_id) for (kind, item_id), data in batch.items() if data is None]
+        for (kind, item_id), data in batch.items():
+            if data is not None:
+                await self.backend.set(self._key(kind, item_id), data)
+        await self.backend.delete(*deleted)
+
+class BotPersistence(BasePersistence):
+    """Сохранение user_data и chat_data между перезапусками бота.
+
+    Данные читаются лениво: при запуске ничего не загружается, а данные
+    пользователя или чата подгружаются из хранилища при первом обновлении от
+    него. Если хранилище общее для нескольких процессов, данные перечитываются
+    при каждом обновлении: изменения других процессов заменяют локальные.
+    Application раз в `update_interval` секунд передает данные затронутых
+    чатов; записываются только изменившиеся, одной пачкой.
+    bot_data (сервисы бота) и история чата здесь не сохраняются.
+    """
+
+    def __init__(self, store: PersistenceStore, update_interval: Optional[float] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=settings.persistence_flush_interval if update_interval is None else update_interval,
+        )
+        self.store = store
+        # Последнее записанное или прочитанное состояние: неизменившиеся данные не пишем
+        self._written: Dict[StateKey, Optional[str]] = {}
+        self._pending: Dict[StateKey, Optional[str]] = {}
+        self._write_lock = asyncio.Lock()
+        self._unserializable_reported = set()
+
+    def _encode(self, key: StateKey, data: dict) -> Optional[str]:
+        state = {}
+        for name, value in data.items():
+            if name in TRANSIENT_KEYS:
+                continue
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                if name not in self._unserializable_reported:
+                    self._unserializable_reported.add(name)
+                    logger.warning(f"⚠️ Значение {key[0]}_data['{name}'] не сохраняется: не сериализуется в JSON")
+                continue
+            state[name] = value
+        return json.dumps(state, ensure_ascii=False, separators=(",", ":"), sort_keys=True) if state else None
+
+    async def _refresh(self, key: StateKey, data: dict):
+        loaded = key in self._written
+        if loaded and not self.store.shared:
+            return
+        try:
+            stored = await self.store.get(*key)
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить {key[0]}_data {key[1]}: {e}")
+            return
+        if not loaded:
+            self._written[key] = stored
+            if stored:
+                # Значения, уже измененные в этом процессе, важнее сохраненных
+                for name, value in json.loads(stored).items():
+                    data.setdefault(name, value)
+            return
+        if stored == self._written[key]:
+            return
+        # Данные изменил другой процесс: они новее локальных, включая еще не записанные
+        self._written[key] = stored
+        self._pending.pop(key, None)
+        for name in [name for name in data if name not in TRANSIENT_KEYS]:
+            del data[name]
+        if stored:
+            data.update(json.loads(stored))
+        logger.debug(f"🔄 {key[0]}_data {key[1]} изменены другим процессом, перечитаны")
+
+    async def _stage(self, key: StateKey, encoded: Optional[str]):
+        if key in self._written and self._written[key] == encoded and key not in self._pending:
+            return
+        self._pending[key] = encoded
+        # Application передает данные всех затронутых чатов разом: даем им собраться в одну пачку
+        await asyncio.sleep(0)
+        async with self._write_lock:
+            await self._write_pending()
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.store.write(batch)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить данные {len(batch)} пользователей и чатов: {e}")
+            # Повторим при следующей записи, если данные не успели обновиться
+            for key, encoded in batch.items():
+                self._pending.setdefault(key, encoded)
+            return
+        self._written.update(batch)
+        logger.debug(f"💾 Сохранены данные {len(batch)} пользователей и чатов")
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._stage(("user", user_id), self._encode(("user", user_id), data))
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._stage(("chat", chat_id), self._encode(("chat", chat_id), data))
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._stage(("user", user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._stage(("chat", chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh(("user", user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh(("chat", chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        async with self._write_lock:
+            await self._write_pending()
+
+    async def close(self):
+        """Записать несохраненное и закрыть хранилище; вызывается после Application.shutdown()"""
+        await self.flush()
+        await self.store.close()
+
+def create_persistence() -> Optional[BotPersistence]:
+    """Persistence по настройкам: общий бэкенд состояния, если он есть, иначе SQLite-файл"""
+    if not settings.persistence_enabled:
+        return None
+    if state_backend.shared:
+        return BotPersistence(BackendPersistenceStore(state_backend))
+    return BotPersistence(SQLitePersistenceStore(settings.persistence_file))
@@ -0,0 +1,137 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from telegram import Message, Update
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Склеенный вопрос не длиннее одного сообщения Telegram
+MAX_MERGED_CHARS = 4096
+
+class _Burst:
+    """Сообщения пользователя, пришедшие быстрее rate_limit_sec и ждущие склейки"""
+
+    __slots__ = ("texts", "chars", "message", "update_id", "timer")
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.chars = 0
+        self.message: Optional[Message] = None
+        self.update_id = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class MessageThrottle:
+    """Ограничение частоты вопросов к LLM: не чаще одного на пользователя за rate_limit_sec.
+
+    Проверяет сообщения для LLM в момент получения, до очереди чата (см.
+    ChatOrderedUpdateProcessor): обработчики вызываются уже после ожидания в
+    очереди и время прихода сообщений не видят. Сообщения, пришедшие раньше
+    конца окна, не отбрасываются: они копятся и по окончании окна попадают в
+    `update_queue` одним обновлением со склеенным текстом. В памяти хранятся
+    только пользователи, писавшие за последние rate_limit_sec секунд (и не
+    больше throttle_max_users).
+
+    При остановке бота `close()` отправляет накопленные сообщения сразу, пока
+    Application еще разбирает очередь обновлений.
+    """
+
+    def __init__(self, update_queue: asyncio.Queue, interval: Optional[float] = None, max_users: Optional[int] = None):
+        self.update_queue = update_queue
+        self.interval = settings.rate_limit_sec if interval is None else interval
+        self.max_users = max_users or settings.throttle_max_users
+        # Пользователь -> время последнего пропущенного вопроса; порядок — по времени
+        self._last: "OrderedDict[int, float]" = OrderedDict()
+        self._bursts: Dict[Tuple[int, int], _Burst] = {}
+        # Склеенные обновления, которые уже прошли ограничение. Храним сами объекты,
+        # чтобы их id не достался новым обновлениям, пока склеенное ждет обработки
+        self._released: Dict[int, Update] = {}
+        self._closed = False
+        self.deferred = 0  # Сообщений, отложенных для склейки
+        self.merged = 0    # Сообщений, склеенных с предыдущими
+
+    def _evict(self, now: float):
+        while self._last:
+            user_id, admitted_at = next(iter(self._last.items()))
+            if now - admitted_at < self.interval and len(self._last) < self.max_users:
+                break
+            self._last.popitem(last=False)
+
+    def _admit(self, user_id: int, now: float):
+        self._last[user_id] = now
+        self._last.move_to_end(user_id)
+
+    def __call__(self, update: Update) -> bool:
+        """Обработать ли сообщение сейчас; False — оно отложено для склейки"""
+        if self._released.pop(id(update), None) is not None:
+            return True
+        if self._closed or self.interval <= 0 or update.message is None or update.effective_user is None:
+            return True
+
+        now = time.monotonic()
+        self._evict(now)
+        user_id = update.effective_user.id
+        key = (update.effective_chat.id, user_id)
+        burst = self._bursts.get(key)
+        if burst is None and user_id not in self._last:
+            self._admit(user_id, now)
+            return True
+
+        if burst is None:
+            burst = self._bursts[key] = _Burst()
+            delay = self._last[user_id] + self.interval - now
+            burst.timer = asyncio.get_running_loop().call_later(delay, self._release, key)
+
+        text = update.message.text or ""
+        if burst.chars + len(text) + 1 <= MAX_MERGED_CHARS:
+            burst.texts.append(text)
+            burst.chars += len(text) + 1
+        else:
+            logger.warning(f"⚠️ Слишком много сообщений подряд от {user_id}, лишнее не учитывается")
+        # Отвечаем на последнее сообщение серии
+        burst.message = update.message
+        burst.update_id = update.update_id
+        self.deferred += 1
+        return False
+
+    def _release(self, key: Tuple[int, int]):
+        """Отправить накопленные сообщения одним обновлением"""
+        burst = self._bursts.pop(key)
+        data = burst.message.to_dict()
+        # Разметка относится к тексту одного сообщения и к склеенному не подходит
+        data.pop("entities", None)
+        data["text"] = "\n".join(burst.texts)
+        update = Update(burst.update_id, message=Message.de_json(data, burst.message.get_bot()))
+
+        self._admit(key[1], time.monotonic())
+        self._released[id(update)] = update
+        if len(burst.texts) > 1:
+            self.merged += len(burst.texts) - 1
+            logger.info(f"🧵 Склеено {len(burst.texts)} сообщений пользователя {key[1]}")
+        self.update_queue.put_nowait(update)
+
+    def discard(self, update: object):
+        """Забыть обновление, которое обработано без проверки (например, склеенный текст не прошел фильтр)"""
+        self._released.pop(id(update), None)
+
+    def close(self):
+        """Отменить таймеры и сразу отправить накопленные сообщения; дальше сообщения не задерживаются"""
+        self._closed = True
+        for key in list(self._bursts):
+            self._bursts[key].timer.cancel()
+            self._release(key)
+
+def backlog(application, api_client) -> int:
+    """Вопросы, ждущие обработки: в очередях чатов и в очереди к LLM.
+
+    Число одновременных вызовов chat() ограничено max_concurrent_updates, поэтому
+    при перегрузке очередь растет в основном перед обработчиком, а не у LLM.
+    """
+    processor = application.update_processor
+    return getattr(processor, "queued_updates", 0) + api_client.queue_depth
+
+def is_overloaded(application, api_client) -> bool:
+    """Очередь слишком длинная: новые вопросы обслуживаются только из кэша"""
+    return 0 < settings.llm_shed_queue_depth <= backlog(application, api_client)
@@ -0,0 +1,103 @@
+import sys
+import asyncio
+from typing import Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from telegram.ext.filters import BaseFilter
+from bot.throttle import MessageThrottle
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Сколько обновлений всего может ждать своей очереди на один слот обработки
+WAITING_PER_SLOT = 8
+OVERFLOW_MESSAGE = "Слишком много сообщений подряд. Дождитесь ответа на предыдущие вопросы."
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления, подходящие под фильтр `ordered` (сообщения для LLM), одного
+    чата выполняются строго по очереди, а разных чатов — параллельно, не более
+    `max_concurrent_updates` одновременно. Остальные обновления (команды,
+    меню, документы) выполняются сразу и не ждут запросов к LLM.
+
+    `gate` проверяет упорядоченные обновления в момент получения, до очереди
+    чата; отклоненные им обновления не обрабатываются. Очередь ограничена:
+    не больше `max_waiting_per_chat` на чат и `max_concurrent_updates *
+    WAITING_PER_SLOT` всего, лишние сообщения получают ответ и отбрасываются.
+    """
+
+    def __init__(self, max_concurrent_updates: int, ordered: BaseFilter,
+                 gate: Optional[MessageThrottle] = None,
+                 max_waiting_per_chat: Optional[int] = None):
+        # Общий лимит PTB не используем: его занимали бы и ожидающие очереди чата, и команды меню
+        super().__init__(sys.maxsize)
+        self.max_waiting = max_concurrent_updates * WAITING_PER_SLOT
+        self.max_waiting_per_chat = max_waiting_per_chat or settings.max_waiting_updates_per_chat
+        self.ordered = ordered
+        self.gate = gate
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+        self._queued = 0
+
+    def _ordered_chat_id(self, update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat and self.ordered.check_update(update):
+            return update.effective_chat.id
+        return None
+
+    @property
+    def waiting_updates(self) -> int:
+        """Сколько упорядоченных обновлений выполняется или ждет своей очереди"""
+        return sum(self._waiting.values())
+
+    @property
+    def queued_updates(self) -> int:
+        """Сколько упорядоченных обновлений еще ждет очереди чата или слота обработки"""
+        return self._queued
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        chat_id = self._ordered_chat_id(update)
+        if chat_id is None:
+            if self.gate is not None:
+                # Склеенное гейтом обновление могло не подойти под фильтр: гейт должен его забыть
+                self.gate.discard(update)
+            await coroutine
+            return
+        if self.gate is not None and not self.gate(update):
+            coroutine.close()
+            return
+        if self._waiting.get(chat_id, 0) >= self.max_waiting_per_chat or self._queued >= self.max_waiting:
+            coroutine.close()
+            logger.warning(f"⚠️ Очередь обновлений переполнена (чат {chat_id}), сообщение отброшено")
+            try:
+                await update.effective_message.reply_text(OVERFLOW_MESSAGE)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось ответить на отброшенное сообщение: {e}")
+            return
+
+        # asyncio.Lock будит ожидающих в порядке прихода — это и есть порядок сообщений чата
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._waiting[chat_id] = self._waiting.get(chat_id, 0) + 1
+        self._queued += 1
+        started = False
+        try:
+            async with lock:
+                async with self._slots:
+                    self._queued -= 1
+                    started = True
+                    await coroutine
+        finally:
+            if not started:
+                self._queued -= 1
+            self._waiting[chat_id] -= 1
+            if not self._waiting[chat_id]:
+                del self._waiting[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
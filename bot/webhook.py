@@ -0,0 +1,65 @@
+import hmac
+import json
+from telegram import Update
+from telegram.ext import Application
+from config import settings
+from services.http_server import HTTPServer, Request, Response
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+class WebhookServer:
+    """Прием обновлений Telegram через webhook.
+
+    POST на `webhook_path` с верным секретным заголовком кладет обновление в
+    очередь приложения и сразу отвечает 200; обработка идет в приложении как
+    при polling. GET /healthz сообщает о готовности (503 во время остановки).
+    """
+
+    def __init__(self, application: Application):
+        self.application = application
+        self.secret_token = settings.webhook_secret_token
+        if not self.secret_token:
+            # Случайный секрет у каждого процесса ломает работу нескольких экземпляров за балансировщиком
+            raise ValueError("WEBHOOK_SECRET_TOKEN не задан: в режиме webhook он обязателен")
+        self.server = HTTPServer(settings.webhook_listen, settings.webhook_port)
+        self.server.route("POST", settings.webhook_path, self.handle_update)
+        self.server.route("GET", "/healthz", self.handle_health)
+
+    async def handle_update(self, request: Request) -> Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode("utf-8"), self.secret_token.encode("utf-8")):
+            logger.warning("⚠️ Webhook-запрос с неверным секретным токеном")
+            return Response(401)
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning(f"⚠️ Некорректное обновление в webhook: {e}")
+            return Response(400)
+        await self.application.update_queue.put(update)
+        return Response(200)
+
+    async def handle_health(self, request: Request) -> Response:
+        if self.server.draining or not self.application.running:
+            return Response.json({"status": "stopping"}, status=503)
+        return Response.json({"status": "ok"})
+
+    async def start(self):
+        await self.server.start()
+        if settings.webhook_url:
+            await self.application.bot.set_webhook(
+                url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=settings.webhook_max_connections,
+            )
+            logger.info(f"✅ Webhook зарегистрирован: {settings.webhook_url}")
+        else:
+            logger.info("ℹ️ WEBHOOK_URL не задан: webhook в Telegram не регистрируется (локальный режим)")
+
+    async def stop(self):
+        """Перестать принимать обновления; уже принятые обработает application.stop()"""
+        # Webhook в Telegram не удаляем: его продолжают обслуживать другие экземпляры
+        await self.server.stop(settings.webhook_drain_timeout)
@@ -2,27 +2,111 @@ from pydantic_settings import BaseSettings
 from pydantic import Field, validator
 from typing import Optional, List
 import os
+import re
 
 class Settings(BaseSettings):
     bot_token: str = Field(..., description="Токен Telegram-бота")
     ya_api_key: str = Field(..., description="API-ключ Yandex Cloud")
     ya_folder_id: str = Field(..., description="ID облака в Yandex Cloud")
 
+    run_mode: str = "polling"  # polling или webhook
+    webhook_url: str = ""  # Публичный адрес бота, например https://bot.example.com; пусто — не регистрировать
+    webhook_path: str = "/telegram"
+    webhook_listen: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret_token: str = ""  # Обязателен при webhook, общий для всех экземпляров; A-Z, a-z, 0-9, _ и -
+    webhook_max_connections: int = 40
+    webhook_drain_timeout: float = 10.0  # Сколько ждать начатые запросы при остановке, сек
+    metrics_listen: str = "127.0.0.1"  # /metrics без авторизации: наружу открывать только за защищенной сетью
+    metrics_port: int = 0  # GET /metrics для Prometheus; 0 — выключено. Совпадает с webhook_port — общий сервер
+
+    state_backend: str = "local"  # local — файлы одного процесса, redis — общее состояние нескольких процессов
+    redis_url: str = "redis://localhost:6379/0"
+    state_key_prefix: str = "ussadba:"
+    chat_lock_ttl: float = 120.0  # Блокировка чата снимается сама, если процесс упал; пока чат обрабатывается, продлевается, сек
+    chat_lock_wait: float = 30.0  # Сколько ждать блокировку чата, сек
+    history_max_records: int = 500  # Записей истории чата в Redis; дальше них сводка при загрузке не ищется
+
     documents_dir: str = "data/documents"
+    knowledge_dir: str = "data/knowledge"  # Справочные тексты для поиска: факты о проекте, не отправляются как документы
     history_dir: str = "data/history"
     logs_dir: str = "data/logs"
     cache_file: str = "data/cache.json"
+    file_id_cache_file: str = "data/file_ids.json"
     prompts_dir: str = "prompts"
 
-    rate_limit_sec: int = 2
-    max_history_pairs: int = 10  # Уменьшено для производительности
+    documents_check_interval: float = 5.0  # Как часто проверять mtime папки документов, сек
+    documents_full_scan_interval: float = 60.0  # Полная проверка файлов: замена файла на месте не меняет mtime папки, сек
+    retrieval_enabled: bool = True  # Добавлять в запрос релевантные фрагменты документов
+    retrieval_index_file: str = "data/retrieval_index.json"
+    retrieval_top_k: int = 3
+    retrieval_chunk_chars: int = 500  # Справочные абзацы короткие: крупные фрагменты тянут в запрос соседние факты
+    retrieval_min_score: float = 0.3  # Минимальная оценка BM25 фрагмента
+    prompts_check_interval: float = 5.0  # Как часто проверять изменения файлов промптов, сек
+    prompt_map_check_interval: float = 5.0  # Как часто проверять изменения prompt_map.json, сек
+    intent_classifier_enabled: bool = True  # Использовать модель интентов, если она обучена
+    intent_model_file: str = "data/intent_model.npz"  # Создается train_intent_classifier.py
+    intent_min_confidence: float = 0.8  # Ниже — интент берется из ключевых слов или прежний
+
+    rate_limit_sec: int = 2  # Не чаще одного вопроса к LLM от пользователя; частые сообщения склеиваются
+    throttle_max_users: int = 100000  # Предел пользователей в памяти ограничителя частоты
+    max_concurrent_updates: int = 16  # Обновлений разных чатов, обрабатываемых одновременно
+    max_waiting_updates_per_chat: int = 5  # Вопросов одного чата в очереди, лишние отклоняются
+    max_history_pairs: int = 10  # Пар в памяти; в запрос попадает столько, сколько вмещает context_token_budget
+    history_flush_interval: float = 2.0  # Период фоновой записи истории, сек
+    persistence_enabled: bool = True  # Сохранять user_data и chat_data между перезапусками
+    persistence_file: str = "data/bot_state.sqlite3"  # При STATE_BACKEND=redis данные хранятся в Redis
+    persistence_flush_interval: float = 10.0  # Период записи измененных данных чатов, сек
+    summary_enabled: bool = True  # Сворачивать старые пары длинной истории в сводку
+    # summary_keep_pairs < summary_trigger_pairs < max_history_pairs: иначе история обрезается раньше, чем сжимается
+    summary_trigger_pairs: int = 8  # Пар в истории, после которых запускается сжатие
+    summary_keep_pairs: int = 4  # Последних пар, которые остаются без сжатия
+    summary_model: str = "yandexgpt-lite"
+    summary_max_tokens: int = 400
     max_cache_size: int = 1000
+    max_cache_bytes: int = 50 * 1024 * 1024
+    cache_ttl_sec: int = 0  # 0 — записи кэша не устаревают
+    cache_backend: str = "journal"  # journal (append-only JSONL) или sqlite
+    cache_compaction_min_records: int = 1000
 
     llm_temperature: float = 0.3
     llm_max_tokens: int = 1000  # Увеличено для более полных ответов
+    llm_timeout: float = 30.0
+    llm_breaker_failure_threshold: int = 5  # Ошибок подряд до размыкания цепи
+    llm_breaker_open_sec: float = 30.0  # Сколько отклонять запросы перед пробным
+    llm_breaker_slow_call_sec: float = 20.0  # Более медленный ответ считается ошибкой, 0 — не учитывать
+    llm_hedging: bool = False  # Дублировать запрос (в потоке — до первой части ответа), если ответа нет дольше p95
+    llm_hedge_min_samples: int = 20
+    llm_pool_max_connections: int = 20
+    llm_pool_max_keepalive: int = 10
+    llm_pool_keepalive_expiry: float = 120.0  # Сколько держать простаивающее соединение
+    llm_http2: bool = True  # Используется, если установлен пакет h2
+    llm_pool_prewarm: int = 2  # Соединений, открываемых при запуске
+    llm_keep_warm_interval: float = 60.0  # Пинг в простое, 0 — отключить; меньше keepalive_expiry
+    context_token_budget: int = 6000  # Токенов на запрос без учета ответа
+    context_token_estimator: str = "local"  # local — оценка по длине, yandex — API токенизации
+    context_chars_per_token: float = 3.0
+    llm_shed_queue_depth: int = 50  # Вопросов в очередях чатов и к LLM, после которого отвечаем из кэша или «занято», 0 — выкл.
+    llm_max_concurrency: int = 4  # Одновременных запросов к Yandex
+    llm_rate_per_sec: float = 10.0  # Квота запросов в секунду, 0 — без ограничения
+    llm_rate_burst: int = 10
+    llm_tokenize_rate_per_sec: float = 10.0  # Отдельная квота API токенизации (context_token_estimator=yandex), 0 — без ограничения
+    llm_max_retries: int = 3  # Повторы при 429/5xx и сетевых ошибках
+    llm_backoff_base: float = 0.5
+    llm_backoff_max: float = 8.0
+    llm_streaming: bool = True  # Показывать ответ по мере генерации
+    stream_edit_interval: float = 1.0  # Минимальный интервал между правками сообщения, сек
 
     debug: bool = False
     use_cache: bool = True
+    use_faq_cache: bool = True
+    faq_cache_ttl_sec: int = 24 * 60 * 60
+
+    semantic_cache_enabled: bool = True  # Требует numpy
+    semantic_cache_embedder: str = "local"  # local (хэширование) или yandex
+    semantic_cache_threshold: float = 0.85
+    semantic_cache_dim: int = 256
+    semantic_cache_max_entries: int = 20000  # На один интент
 
     allowed_document_types: List[str] = ['.pdf', '.txt', '.docx', '.xlsx', '.pptx', '.jpg', '.png']
 
@@ -33,7 +117,7 @@ class Settings(BaseSettings):
         env_file_encoding = "utf-8"
         extra = "ignore"
 
-    @validator('documents_dir', 'history_dir', 'logs_dir', 'prompts_dir', pre=True)
+    @validator('documents_dir', 'knowledge_dir', 'history_dir', 'logs_dir', 'prompts_dir', pre=True)
     def ensure_directories_exist(cls, v):
         """Создает директории при их инициализации"""
         os.makedirs(v, exist_ok=True)
@@ -41,7 +125,7 @@ class Settings(BaseSettings):
 
     def ensure_directories(self):
         """Убедиться, что все директории существуют"""
-        for path in [self.documents_dir, self.history_dir, self.logs_dir, self.prompts_dir]:
+        for path in [self.documents_dir, self.knowledge_dir, self.history_dir, self.logs_dir, self.prompts_dir]:
             os.makedirs(path, exist_ok=True)
             print(f"✅ Убедились, что существует: {path}")
 
@@ -59,6 +143,13 @@ class Settings(BaseSettings):
                 return False
             if not self.ya_folder_id or len(self.ya_folder_id) < 5:
                 return False
+            if self.run_mode == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", self.webhook_secret_token):
+                print("❌ Для RUN_MODE=webhook задайте WEBHOOK_SECRET_TOKEN: 1–256 символов A-Z, a-z, 0-9, _ и -")
+                return False
+            if self.summary_enabled and not (
+                    0 <= self.summary_keep_pairs < self.summary_trigger_pairs < self.max_history_pairs):
+                print("❌ Нужно SUMMARY_KEEP_PAIRS < SUMMARY_TRIGGER_PAIRS < MAX_HISTORY_PAIRS, иначе история не сжимается")
+                return False
             return True
         except Exception:
             return False
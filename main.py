@@ -14,15 +14,28 @@ logger.info("🔧 Логирование инициализировано")
 
 # Импортируем модули
 from bot.application import create_application
+from bot.webhook import WebhookServer
+from services.http_server import HTTPServer
+from services.metrics import metrics, handle_metrics
 from services.llm import YandexLLM
-from services.cache import cache
+from services.cache import cache, faq_cache
+from services.file_id_cache import file_id_cache
+from services.documents import catalog
+from services.retrieval import document_index
+from services.semantic_cache import semantic_cache
+from services.history import history_writer
+from services.singleflight import llm_singleflight
+from services.summarizer import summarizer
+from services.state_backend import state_backend
 from config import settings
 
 # Глобальная переменная для хранения приложения
 application = None
+webhook_server = None
+metrics_server = None
 
 async def main():
-    global application
+    global application, webhook_server, metrics_server
     
     try:
         if not settings.is_valid():
@@ -31,22 +44,77 @@ async def main():
 
         # Инициализируем кэш
         await cache.initialize()
+        await faq_cache.initialize()
         logger.info("✅ Кэш инициализирован")
+
+        await file_id_cache.initialize()
+        logger.info("✅ Кэш file_id документов инициализирован")
+
+        catalog.refresh(force=True)
+        logger.info(f"✅ Каталог документов загружен: {len(catalog.documents)} шт.")
+
+        if settings.retrieval_enabled:
+            await document_index.refresh(force=True)
         
         # Создаем сервис LLM
         llm_service = YandexLLM()
+        await llm_service.warm_up()
         logger.info("✅ LLM сервис инициализирован")
         
         # Создаем приложение и передаем сервис LLM
         application = create_application(settings.bot_token)
         application.bot_data["llm_service"] = llm_service
+        metrics.callback("bot_llm_queue_depth", "Запросы, ожидающие слота к LLM", "gauge",
+                         lambda: llm_service.api_client.queue_depth)
+        metrics.callback("bot_llm_breaker_rejected_total", "Запросы, отклоненные размыкателем цепи", "counter",
+                         lambda: llm_service.api_client.breaker.rejected)
+        metrics.callback("bot_llm_hedged_total", "Дублирующие запросы к LLM: отправленные и ответившие раньше исходных",
+                         "counter", lambda: {("sent",): llm_service.api_client.hedged_requests,
+                                             ("won",): llm_service.api_client.hedge_wins}, ["result"])
+        throttle = application.bot_data["throttle"]
+        metrics.callback("bot_throttle_messages_total", "Частые сообщения: отложенные для склейки и склеенные с предыдущими",
+                         "counter", lambda: {("deferred",): throttle.deferred, ("merged",): throttle.merged}, ["result"])
+        # Статистика пула соединений: по ней подбираются настройки llm_pool_*
+        pool_stats = llm_service.api_client.pool_stats
+        metrics.callback("bot_llm_pool_in_flight", "HTTP-запросы к LLM в работе, включая ожидающие соединения", "gauge",
+                         lambda: pool_stats()["in_flight"])
+        metrics.callback("bot_llm_pool_peak_in_flight", "Наибольшее число HTTP-запросов к LLM в работе", "gauge",
+                         lambda: pool_stats()["peak_in_flight"])
+        metrics.callback("bot_llm_pool_requests_total", "HTTP-запросы к LLM через пул", "counter",
+                         lambda: pool_stats()["requests"])
+        metrics.callback("bot_llm_pool_waits_total", "HTTP-запросы, которым не хватило свободного соединения", "counter",
+                         lambda: pool_stats()["waits"])
+        metrics.callback("bot_llm_pool_connections_opened_total", "Открытые пулом соединения", "counter",
+                         lambda: pool_stats()["connections_opened"])
+
+        def pool_connections():
+            stats = pool_stats()
+            return {(state,): stats[state] for state in ("active", "idle") if state in stats}
+
+        metrics.callback("bot_llm_pool_connections", "Соединения пула по состоянию", "gauge", pool_connections, ["state"])
         
         logger.info("🤖 Бот запущен. Ожидание сообщений...")
         
         # Запускаем бота с обработкой сигналов
         await application.initialize()
         await application.start()
-        await application.updater.start_polling()
+        if settings.run_mode == "webhook":
+            webhook_server = WebhookServer(application)
+            if settings.metrics_port == settings.webhook_port:
+                webhook_server.server.route("GET", "/metrics", handle_metrics)
+            await webhook_server.start()
+        else:
+            await application.updater.start_polling()
+
+        if settings.metrics_port and not (webhook_server and settings.metrics_port == settings.webhook_port):
+            metrics_server = HTTPServer(settings.metrics_listen, settings.metrics_port)
+            metrics_server.route("GET", "/metrics", handle_metrics)
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                # Без метрик бот работает, поэтому занятый порт не повод останавливаться
+                logger.error(f"❌ Не удалось запустить сервер метрик на {settings.metrics_listen}:{settings.metrics_port}: {e}")
+                metrics_server = None
         
         # Бесконечный цикл ожидания
         while True:
@@ -58,15 +126,35 @@ async def main():
         logger.error(f"🔴 Фатальная ошибка: {e}", exc_info=True)
     finally:
         # Корректное завершение работы
+        if webhook_server:
+            # Сначала перестаем принимать обновления, затем обрабатываем принятые
+            await webhook_server.stop()
+        if metrics_server:
+            await metrics_server.stop()
         if application:
-            await application.updater.stop()
+            if application.updater.running:
+                await application.updater.stop()
+            if "throttle" in application.bot_data:
+                # Отложенные для склейки вопросы попадут в очередь до ее последнего разбора
+                application.bot_data["throttle"].close()
             await application.stop()
             await application.shutdown()
+            if application.persistence:
+                await application.persistence.close()
         
+        await summarizer.close()
         if 'llm_service' in locals():
+            logger.info(f"📊 Пул соединений LLM: {llm_service.api_client.pool_stats()}")
             await llm_service.close()
             logger.info("✅ Ресурсы освобождены")
 
+        logger.info(f"📊 Объединение запросов к LLM: {llm_singleflight.stats()}")
+        await history_writer.close()
+        await cache.close()
+        await faq_cache.close()
+        await semantic_cache.close()
+        await state_backend.close()
+
 def handle_signal(signum, frame):
     """Обработчик сигналов для graceful shutdown"""
     logger.info(f"Получен сигнал {signum}, завершаем работу...")
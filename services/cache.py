@@ -1,21 +1,43 @@
-import os
-import json
-import aiofiles
+import time
 import asyncio
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
 from config import settings
+from services.cache_storage import CacheStorage, create_cache_storage
+from services.state_backend import StateBackend, state_backend
+from services.metrics import metrics
 from utils.logger import setup_logger
 
 logger = setup_logger()
 
+class CacheEntry(NamedTuple):
+    value: str
+    expires_at: Optional[float]  # Время истечения (time.time()), None — без TTL
+    size: int                    # Размер ключа и значения в байтах
+
 class FileCache:
-    def __init__(self):
-        self.filename = settings.cache_file
+    """LRU-кэш ответов с опциональным TTL и ограничением по числу записей и байтам"""
+
+    def __init__(self, storage: Optional[CacheStorage] = None,
+                 max_size: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        self.storage = storage or create_cache_storage()
         self.lock = asyncio.Lock()
-        self.max_size = 1000
-        self._cache = {}
+        self.max_size = max_size or settings.max_cache_size
+        self.max_bytes = max_bytes or settings.max_cache_bytes
+        self.ttl = settings.cache_ttl_sec if ttl is None else ttl
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
         self._loaded = False
-        self._memory_cache = {}  # Быстрый in-memory кэш
+        self._compacting = False
+
+        # Счетчики для подбора размера кэша
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+        self.expirations = 0
 
     async def initialize(self):
         """Инициализировать кэш (должен быть вызван после запуска event loop)"""
@@ -24,67 +46,201 @@ class FileCache:
 
     async def _load_cache(self):
         async with self.lock:
-            if not os.path.exists(self.filename):
-                self._cache = {}
-                return
-                
+            self._entries.clear()
+            self._bytes = 0
             try:
-                async with aiofiles.open(self.filename, 'r', encoding='utf-8') as f:
-                    content = await f.read()
-                    if not content.strip():
-                        self._cache = {}
-                    else:
-                        self._cache = json.loads(content)
-                        # Загружаем в memory cache
-                        self._memory_cache = self._cache.copy()
+                stored = await self.storage.load()
             except Exception as e:
                 logger.error(f"❌ Ошибка при загрузке кэша: {e}")
-                self._cache = {}
+                return
 
-    async def _save_cache(self):
-        async with self.lock:
-            try:
-                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
-                async with aiofiles.open(self.filename, 'w', encoding='utf-8') as f:
-                    await f.write(json.dumps(self._cache, ensure_ascii=False, indent=2))
-            except Exception as e:
-                logger.error(f"❌ Ошибка при сохранении кэша: {e}")
+            now = time.time()
+            for key, (value, expires_at) in stored.items():
+                if expires_at is not None and expires_at <= now:
+                    continue
+                self._put(key, value, expires_at)
+            self._evict()
+
+    @staticmethod
+    def _entry_size(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8"))
+
+    def _put(self, key: str, value: str, expires_at: Optional[float]):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        entry = CacheEntry(value, expires_at, self._entry_size(key, value))
+        self._entries[key] = entry
+        self._bytes += entry.size
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> list:
+        """Вытеснить наименее востребованные записи сверх лимитов"""
+        removed = []
+        while self._entries and (len(self._entries) > self.max_size or self._bytes > self.max_bytes):
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+            removed.append(key)
+        return removed
+
+    async def _write(self, key: str, entry: Optional[CacheEntry], removed: list):
+        try:
+            # entry отсутствует, если значение само превысило лимит по байтам
+            if entry is not None:
+                await self.storage.put(key, entry.value, entry.expires_at)
+            await self.storage.delete(removed)
+            if not self._compacting and self.storage.needs_compaction(len(self._entries)):
+                self._compacting = True
+                try:
+                    await self.storage.compact(
+                        [(k, e.value, e.expires_at) for k, e in self._entries.items()]
+                    )
+                finally:
+                    self._compacting = False
+        except Exception as e:
+            logger.error(f"❌ Ошибка при сохранении кэша: {e}")
 
     async def get(self, key: str) -> Optional[str]:
         if not self._loaded:
             await self.initialize()
-        
-        # Сначала проверяем in-memory кэш
-        if key in self._memory_cache:
-            return self._memory_cache[key]
-            
-        return self._cache.get(key)
-
-    async def set(self, key: str, value: str):
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires_at is not None and entry.expires_at <= time.time():
+            # Просроченные записи удаляются из файла при сжатии или загрузке
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Сохранить значение; ttl в секундах переопределяет settings.cache_ttl_sec"""
         if not self._loaded:
             await self.initialize()
-            
-        self._cache[key] = value
-        self._memory_cache[key] = value  # Сохраняем в memory cache
-        
-        if len(self._cache) > self.max_size:
-            # Удаляем самые старые ключи
-            keys_to_remove = list(self._cache.keys())[:100]
-            for k in keys_to_remove:
-                del self._cache[k]
-                if k in self._memory_cache:
-                    del self._memory_cache[k]
-                    
-        # Сохраняем асинхронно без блокировки
-        asyncio.create_task(self._save_cache())
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self.sets += 1
+        self._put(key, value, expires_at)
+        removed = self._evict()
+        # Записываем в хранилище только изменившиеся записи
+        await self._write(key, self._entries.get(key), removed)
 
     async def clear(self):
         if not self._loaded:
             await self.initialize()
-            
-        self._cache.clear()
-        self._memory_cache.clear()
-        await self._save_cache()
 
-# Глобальный экземпляр кэша
-cache = FileCache()
\ No newline at end of file
+        self._entries.clear()
+        self._bytes = 0
+        await self.storage.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Счетчики кэша: попадания, промахи, вытеснения и занятый объем"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def close(self):
+        """Дописать отложенные изменения и закрыть хранилище"""
+        logger.info(f"📊 Статистика кэша: {self.stats()}")
+        await self.storage.close()
+
+class SharedCache:
+    """Кэш ответов в общем хранилище (Redis): один на все процессы бота.
+
+    Интерфейс тот же, что у FileCache. Вытеснением управляет само хранилище
+    (TTL записей и политика maxmemory), поэтому ограничений по размеру здесь нет.
+    """
+
+    def __init__(self, backend: StateBackend, namespace: str, ttl: Optional[float] = None):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = settings.cache_ttl_sec if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+
+    async def initialize(self):
+        pass
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.backend.get(f"{self.namespace}:{key}")
+        except Exception as e:
+            logger.warning(f"⚠️ Общий кэш недоступен: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self.sets += 1
+        try:
+            await self.backend.set(f"{self.namespace}:{key}", value, ttl or None)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось записать в общий кэш: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def close(self):
+        logger.info(f"📊 Статистика кэша {self.namespace}: {self.stats()}")
+
+# Глобальные экземпляры: в общем хранилище, если несколько процессов обслуживают бота
+if state_backend.shared:
+    cache = SharedCache(state_backend, "cache")
+    faq_cache = SharedCache(state_backend, "faq_cache", ttl=settings.faq_cache_ttl_sec)
+else:
+    cache = FileCache()
+
+    # Кэш частых вопросов: ключ — интент и нормализованный вопрос, без истории диалога
+    faq_cache = FileCache(create_cache_storage("faq_cache"), ttl=settings.faq_cache_ttl_sec)
+
+_CACHES = (("cache", cache), ("faq_cache", faq_cache))
+
+def _cache_operations() -> Dict[tuple, float]:
+    # Вытеснения и устаревания считает только локальный FileCache; в общем хранилище их ведет Redis
+    operations = (("hit", "hits"), ("miss", "misses"), ("set", "sets"),
+                  ("eviction", "evictions"), ("expiration", "expirations"))
+    return {
+        (name, operation): getattr(c, attr)
+        for name, c in _CACHES for operation, attr in operations if hasattr(c, attr)
+    }
+
+def _cache_sizes(field: str) -> Dict[tuple, float]:
+    return {(name,): c.stats()[field] for name, c in _CACHES if isinstance(c, FileCache)}
+
+# Счетчики кэшей читаются только при выгрузке метрик и не замедляют get/set
+metrics.callback("bot_cache_operations_total", "Обращения к кэшам ответов", "counter",
+                 _cache_operations, ["cache", "operation"])
+metrics.callback("bot_cache_entries", "Записи в локальных кэшах ответов", "gauge",
+                 lambda: _cache_sizes("entries"), ["cache"])
+metrics.callback("bot_cache_bytes", "Объем ответов в локальных кэшах", "gauge",
+                 lambda: _cache_sizes("bytes"), ["cache"])
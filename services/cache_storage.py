@@ -0,0 +1,261 @@
+import os
+import json
+import sqlite3
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Запись хранилища: значение и время истечения (time.time()) или None
+StoredValue = Tuple[str, Optional[float]]
+
+class CacheStorage(ABC):
+    """Базовое хранилище кэша.
+
+    Все операции с диском выполняются в одном фоновом потоке, поэтому
+    записи применяются строго в порядке вызова и не блокируют event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-storage")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @abstractmethod
+    async def load(self) -> Dict[str, StoredValue]:
+        """Загрузить все записи кэша в порядке от самых старых к самым новым"""
+
+    @abstractmethod
+    async def put(self, key: str, value: str, expires_at: Optional[float] = None):
+        """Сохранить одну запись"""
+
+    @abstractmethod
+    async def delete(self, keys: List[str]):
+        """Удалить записи"""
+
+    @abstractmethod
+    async def clear(self):
+        """Удалить все записи"""
+
+    def needs_compaction(self, live_count: int) -> bool:
+        """Нужно ли переписать хранилище, чтобы избавиться от устаревших записей"""
+        return False
+
+    async def compact(self, items: Iterable[Tuple[str, str, Optional[float]]]):
+        """Переписать хранилище, оставив только переданные записи"""
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+
+class JournalCacheStorage(CacheStorage):
+    """Append-only журнал в формате JSON Lines с периодическим сжатием.
+
+    Каждая запись кэша — одна строка `{"k": ..., "v": ..., "e": ...}`, удаление —
+    `{"k": ..., "d": 1}`. Запись стоит O(размер записи), а при загрузке
+    файл читается построчно, без разбора одного большого JSON-документа.
+    """
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        super().__init__(path)
+        self.legacy_path = legacy_path
+        self.compaction_min_records = settings.cache_compaction_min_records
+        self._records = 0
+        self._file = None
+
+    def _load_sync(self) -> Dict[str, StoredValue]:
+        if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+            return self._migrate_legacy()
+
+        data = {}
+        self._records = 0
+        if not os.path.exists(self.path):
+            return data
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная строка после аварийного завершения
+                    continue
+                self._records += 1
+                # Перезаписанный ключ переносится в конец, сохраняя порядок давности
+                data.pop(record["k"], None)
+                if not record.get("d"):
+                    data[record["k"]] = (record["v"], record.get("e"))
+        return data
+
+    def _migrate_legacy(self) -> Dict[str, StoredValue]:
+        """Однократный перенос старого cache.json в журнал"""
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            data = json.loads(content) if content.strip() else {}
+        except Exception as e:
+            logger.error(f"❌ Не удалось прочитать старый кэш {self.legacy_path}: {e}")
+            return {}
+
+        self._compact_sync([(key, value, None) for key, value in data.items()])
+        logger.info(f"✅ Кэш перенесен из {self.legacy_path} в {self.path}: {len(data)} записей")
+        return {key: (value, None) for key, value in data.items()}
+
+    def _append_sync(self, lines: List[str]):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(lines))
+        self._file.flush()
+        self._records += len(lines)
+
+    @staticmethod
+    def _record(key: str, value: str, expires_at: Optional[float]) -> str:
+        record = {"k": key, "v": value}
+        if expires_at is not None:
+            record["e"] = expires_at
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def _compact_sync(self, items: List[Tuple[str, str, Optional[float]]]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, value, expires_at in items:
+                f.write(self._record(key, value, expires_at))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.path)
+        self._records = len(items)
+
+    def _close_sync(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def load(self) -> Dict[str, StoredValue]:
+        return await self._run(self._load_sync)
+
+    async def put(self, key: str, value: str, expires_at: Optional[float] = None):
+        await self._run(self._append_sync, [self._record(key, value, expires_at)])
+
+    async def delete(self, keys: List[str]):
+        if not keys:
+            return
+        lines = [json.dumps({"k": key, "d": 1}, ensure_ascii=False) + "\n" for key in keys]
+        await self._run(self._append_sync, lines)
+
+    async def clear(self):
+        await self._run(self._compact_sync, [])
+
+    def needs_compaction(self, live_count: int) -> bool:
+        return self._records > max(2 * live_count, self.compaction_min_records)
+
+    async def compact(self, items: Iterable[Tuple[str, str, Optional[float]]]):
+        items = list(items)
+        await self._run(self._compact_sync, items)
+        logger.info(f"🗜 Журнал кэша сжат: {len(items)} записей")
+
+    async def close(self):
+        await self._run(self._close_sync)
+        await super().close()
+
+class SQLiteCacheStorage(CacheStorage):
+    """Хранилище кэша в SQLite в режиме WAL"""
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        super().__init__(path)
+        self.legacy_path = legacy_path
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+            if "expires_at" not in columns:
+                self._conn.execute("ALTER TABLE cache ADD COLUMN expires_at REAL")
+            self._conn.commit()
+        return self._conn
+
+    def _load_sync(self) -> Dict[str, StoredValue]:
+        is_new = not os.path.exists(self.path)
+        conn = self._connect()
+        if is_new and self.legacy_path and os.path.exists(self.legacy_path):
+            try:
+                with open(self.legacy_path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                data = json.loads(content) if content.strip() else {}
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", data.items())
+                logger.info(f"✅ Кэш перенесен из {self.legacy_path} в {self.path}: {len(data)} записей")
+            except Exception as e:
+                logger.error(f"❌ Не удалось перенести старый кэш {self.legacy_path}: {e}")
+        # INSERT OR REPLACE выдает новый rowid, поэтому порядок rowid — порядок давности записи
+        rows = conn.execute("SELECT key, value, expires_at FROM cache ORDER BY rowid")
+        return {key: (value, expires_at) for key, value, expires_at in rows}
+
+    def _put_sync(self, key: str, value: str, expires_at: Optional[float]):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def _delete_sync(self, keys: List[str]):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+
+    def _clear_sync(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def load(self) -> Dict[str, StoredValue]:
+        return await self._run(self._load_sync)
+
+    async def put(self, key: str, value: str, expires_at: Optional[float] = None):
+        await self._run(self._put_sync, key, value, expires_at)
+
+    async def delete(self, keys: List[str]):
+        if keys:
+            await self._run(self._delete_sync, keys)
+
+    async def clear(self):
+        await self._run(self._clear_sync)
+
+    async def close(self):
+        await self._run(self._close_sync)
+        await super().close()
+
+def create_cache_storage(name: Optional[str] = None) -> CacheStorage:
+    """Создать хранилище кэша согласно settings.cache_backend.
+
+    Файлы хранилища лежат рядом с settings.cache_file; для основного кэша
+    старый cache.json переносится в новое хранилище при первом запуске.
+    """
+    base_dir = os.path.dirname(settings.cache_file)
+    default_name = os.path.splitext(os.path.basename(settings.cache_file))[0]
+    legacy_path = settings.cache_file if name is None else None
+    name = name or default_name
+
+    if settings.cache_backend == "sqlite":
+        return SQLiteCacheStorage(os.path.join(base_dir, f"{name}.sqlite3"), legacy_path)
+    if settings.cache_backend != "journal":
+        logger.warning(f"⚠️ Неизвестный cache_backend '{settings.cache_backend}', используется journal")
+    return JournalCacheStorage(os.path.join(base_dir, f"{name}.jsonl"), legacy_path)
@@ -0,0 +1,114 @@
+import math
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Служебные токены роли и разметки на каждое сообщение
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class TokenCounter:
+    """Оценка числа токенов в тексте с кэшем по тексту сообщения.
+
+    По умолчанию оценка локальная (по длине текста). Если передан `tokenize` —
+    функция, возвращающая точное число токенов через API Yandex, — она
+    используется для новых текстов, а при ее ошибке применяется локальная оценка.
+    """
+
+    def __init__(self, tokenize: Optional[Callable[[str], Awaitable[int]]] = None, max_entries: int = 10000):
+        self.tokenize = tokenize
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """Локальная оценка: токенизатор YandexGPT в среднем дает токен на несколько символов"""
+        return math.ceil(len(text) / settings.context_chars_per_token)
+
+    async def count(self, text: str) -> int:
+        tokens = self._counts.get(text)
+        if tokens is not None:
+            self._counts.move_to_end(text)
+            return tokens
+
+        tokens = None
+        if self.tokenize is not None:
+            try:
+                tokens = await self.tokenize(text)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось посчитать токены через API, используем оценку: {e}")
+        if tokens is None:
+            tokens = self.estimate(text)
+
+        self._counts[text] = tokens
+        if len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+        return tokens
+
+class ContextBuilder:
+    """Сборка сообщений запроса в пределах бюджета токенов.
+
+    Системный промпт (со сводкой разговора, если она есть) и текущий вопрос
+    входят всегда. Оставшийся бюджет заполняется парами вопрос-ответ из
+    истории, начиная с самых новых, пока следующая пара помещается целиком.
+    """
+
+    def __init__(self, counter: TokenCounter, budget: Optional[int] = None):
+        self.counter = counter
+        self.budget = settings.context_token_budget if budget is None else budget
+
+    async def _cost(self, text: str) -> int:
+        return await self.counter.count(text) + MESSAGE_OVERHEAD_TOKENS
+
+    async def build(self, system_message: Dict[str, str], history: List[Dict[str, str]], user_message: str,
+                    extra_context: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Сообщения в формате Yandex (role/text) для запроса. system_message —
+        готовое системное сообщение промпта; extra_context — дополнительные
+        сведения, которые дописываются к нему.
+        """
+        sections = list(extra_context or ())
+        summary = next((msg["content"] for msg in history if msg["role"] == "summary"), None)
+        if summary:
+            sections.append(f"Краткое содержание предыдущего разговора:\n{summary}")
+
+        # Промпт и дополнения считаются по отдельности: они повторяются в разных
+        # запросах и берутся из кэша, а склеенный текст каждый раз новый
+        used = await self._cost(system_message["text"]) + await self._cost(user_message)
+        for section in sections:
+            used += await self.counter.count(section)
+        if sections:
+            # Общее сообщение промпта не меняем, а собираем новое
+            system_message = {"role": "system", "text": "\n\n".join([system_message["text"]] + sections)}
+        if used > self.budget:
+            logger.warning(f"⚠️ Системный промпт и вопрос превышают бюджет контекста: {used} > {self.budget}")
+
+        # История разбивается на пары, чтобы не отправлять ответ без вопроса
+        turns = []
+        question = None
+        for msg in history:
+            if msg["role"] == "user":
+                question = msg
+            elif msg["role"] == "assistant" and question is not None:
+                turns.append((question, msg))
+                question = None
+
+        selected = []
+        for question, answer in reversed(turns):
+            cost = await self._cost(question["content"]) + await self._cost(answer["content"])
+            if used + cost > self.budget:
+                break
+            used += cost
+            selected.append((question, answer))
+
+        messages = [system_message]
+        for question, answer in reversed(selected):
+            messages.append({"role": "user", "text": question["content"]})
+            messages.append({"role": "assistant", "text": answer["content"]})
+        messages.append({"role": "user", "text": user_message})
+
+        if len(selected) < len(turns):
+            logger.debug(f"Контекст: {len(selected)} из {len(turns)} пар, ~{used} токенов")
+        return messages
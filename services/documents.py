@@ -0,0 +1,147 @@
+import os
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+class DocumentInfo(NamedTuple):
+    filename: str      # Имя файла с расширением
+    path: str          # Полный путь к файлу
+    name: str          # Имя без расширения
+    ext: str           # Расширение в нижнем регистре
+    size: int
+    mtime_ns: int
+    normalized: str    # Имя без расширения в нижнем регистре
+
+    @property
+    def fingerprint(self) -> Tuple[int, int]:
+        return self.size, self.mtime_ns
+
+class DocumentCatalog:
+    """Каталог документов в памяти.
+
+    Не чаще, чем раз в `documents_check_interval` секунд, проверяется mtime
+    папки, и только при его изменении папка сканируется заново. mtime папки
+    меняется при добавлении, удалении и переименовании файлов, но не при
+    перезаписи файла на месте, поэтому раз в `documents_full_scan_interval`
+    секунд папка сканируется в любом случае. Индекс пересобирается только если
+    изменился состав файлов, их размер или mtime.
+    """
+
+    def __init__(self, documents_dir: Optional[str] = None, check_interval: Optional[float] = None):
+        self.documents_dir = documents_dir or settings.documents_dir
+        self.check_interval = settings.documents_check_interval if check_interval is None else check_interval
+        self.full_scan_interval = settings.documents_full_scan_interval
+        self.version = 0
+        self._documents: List[DocumentInfo] = []
+        self._by_name: Dict[str, DocumentInfo] = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._scanned_at = 0.0
+        self._dir_mtime_ns: Optional[int] = None
+
+    def _scan(self) -> List[DocumentInfo]:
+        if not os.path.isdir(self.documents_dir):
+            logger.warning(f"Папка документов не существует: {self.documents_dir}")
+            return []
+
+        allowed = tuple(ext.lower() for ext in settings.allowed_document_types)
+        documents = []
+        with os.scandir(self.documents_dir) as entries:
+            for entry in entries:
+                # Пропускаем пустые файлы и файлы с неразрешенным расширением
+                if not entry.name.lower().endswith(allowed) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_size == 0:
+                    continue
+                name, ext = os.path.splitext(entry.name)
+                documents.append(DocumentInfo(
+                    filename=entry.name,
+                    path=entry.path,
+                    name=name,
+                    ext=ext.lower(),
+                    size=stat.st_size,
+                    mtime_ns=stat.st_mtime_ns,
+                    normalized=name.lower(),
+                ))
+
+        documents.sort(key=lambda d: d.filename)
+        return documents
+
+    def refresh(self, force: bool = False) -> bool:
+        """Пересканировать папку, если истек интервал проверки. Возвращает True при изменениях"""
+        now = time.monotonic()
+        if not force and self._signature is not None and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        try:
+            dir_mtime_ns = os.stat(self.documents_dir).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime_ns = None
+        except OSError as e:
+            logger.error(f"❌ Ошибка при проверке папки документов: {e}")
+            return False
+        if (not force and self._signature is not None and dir_mtime_ns == self._dir_mtime_ns
+                and now - self._scanned_at < self.full_scan_interval):
+            return False
+        # mtime запоминаем до сканирования: изменения во время него найдет следующая проверка
+        self._dir_mtime_ns = dir_mtime_ns
+        self._scanned_at = now
+
+        try:
+            scanned = self._scan()
+        except OSError as e:
+            logger.error(f"❌ Ошибка при сканировании документов: {e}")
+            return False
+
+        signature = tuple((d.filename, d.size, d.mtime_ns) for d in scanned)
+        if signature == self._signature:
+            return False
+
+        # Убираем дубликаты по имени (без расширения)
+        documents = []
+        by_name = {}
+        for doc in scanned:
+            if doc.normalized not in by_name:
+                by_name[doc.normalized] = doc
+                documents.append(doc)
+
+        self._documents = documents
+        self._by_name = by_name
+        self._signature = signature
+        self.version += 1
+        logger.info(f"📂 Каталог документов обновлен: {[d.filename for d in documents]}")
+        return True
+
+    @property
+    def documents(self) -> List[DocumentInfo]:
+        self.refresh()
+        return self._documents
+
+    def find(self, doc_name: str) -> Optional[DocumentInfo]:
+        """Найти документ по имени: сначала точное совпадение, затем частичное"""
+        self.refresh()
+        query = doc_name.strip().lower()
+        if query in self._by_name:
+            return self._by_name[query]
+        for doc in self._documents:
+            if query in doc.normalized:
+                return doc
+        return None
+
+    def find_by_keywords(self, keywords: Iterable[str]) -> Optional[DocumentInfo]:
+        """Найти первый документ, в имени которого встречается одно из ключевых слов"""
+        keywords = tuple(keywords)
+        for doc in self.documents:
+            if any(keyword in doc.normalized for keyword in keywords):
+                return doc
+        return None
+
+# Глобальный каталог документов
+catalog = DocumentCatalog()
+# Справочные тексты только для поиска по документам; пользователю не отправляются
+knowledge_catalog = DocumentCatalog(settings.knowledge_dir)
@@ -0,0 +1,107 @@
+import os
+import json
+import asyncio
+import aiofiles
+from typing import Dict, Optional, Tuple
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+class FileIdCache:
+    """Кэш Telegram file_id для уже загруженных документов.
+
+    Запись привязана к размеру и mtime файла: если документ на диске
+    изменился, запись считается устаревшей и файл загружается заново.
+    """
+
+    def __init__(self, filename: Optional[str] = None):
+        self.filename = filename or settings.file_id_cache_file
+        self.lock = asyncio.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._loaded = False
+
+    async def initialize(self):
+        """Загрузить сохраненные file_id с диска"""
+        self._entries = {}
+        if os.path.exists(self.filename):
+            try:
+                async with aiofiles.open(self.filename, 'r', encoding='utf-8') as f:
+                    content = await f.read()
+                    if content.strip():
+                        self._entries = json.loads(content)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при загрузке кэша file_id: {e}")
+        self._loaded = True
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        return os.path.normcase(os.path.abspath(file_path))
+
+    @staticmethod
+    def _fingerprint(file_path: str) -> Tuple[int, int]:
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    async def _save(self):
+        async with self.lock:
+            tmp_path = f"{self.filename}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+                async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+                    await f.write(json.dumps(self._entries, ensure_ascii=False))
+                os.replace(tmp_path, self.filename)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при сохранении кэша file_id: {e}")
+
+    async def get(self, file_path: str, fingerprint: Optional[Tuple[int, int]] = None) -> Optional[str]:
+        """Вернуть file_id, если файл не менялся с момента загрузки.
+
+        `fingerprint` — заранее известные (размер, mtime_ns) файла, чтобы не делать stat.
+        """
+        if not self._loaded:
+            await self.initialize()
+
+        key = self._key(file_path)
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+
+        try:
+            size, mtime_ns = fingerprint or self._fingerprint(file_path)
+        except OSError:
+            await self.invalidate(file_path)
+            return None
+
+        if entry.get("size") != size or entry.get("mtime_ns") != mtime_ns:
+            logger.info(f"♻️ Документ изменился, file_id сброшен: {file_path}")
+            await self.invalidate(file_path)
+            return None
+
+        return entry.get("file_id")
+
+    async def set(self, file_path: str, file_id: str, fingerprint: Optional[Tuple[int, int]] = None):
+        """Запомнить file_id, выданный Telegram после загрузки файла"""
+        if not self._loaded:
+            await self.initialize()
+
+        try:
+            size, mtime_ns = fingerprint or self._fingerprint(file_path)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось получить данные файла {file_path}: {e}")
+            return
+
+        self._entries[self._key(file_path)] = {
+            "file_id": file_id,
+            "size": size,
+            "mtime_ns": mtime_ns,
+        }
+        await self._save()
+
+    async def invalidate(self, file_path: str):
+        """Удалить запись о файле"""
+        if self._entries.pop(self._key(file_path), None) is not None:
+            await self._save()
+
+# Глобальный экземпляр кэша file_id
+file_id_cache = FileIdCache()
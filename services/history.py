@@ -1,27 +1,290 @@
 import os
 import json
+import time
+import asyncio
 import aiofiles
+from typing import Awaitable, Callable, Dict, List, Optional
 from config import settings
+from services.state_backend import state_backend
+from services.metrics import HISTORY_SECONDS
 from utils.logger import setup_logger
 
 logger = setup_logger()
 
-async def load_history(chat_id: int) -> list:
-    path = os.path.join(settings.history_dir, f"chat_{chat_id}.json")
-    if os.path.exists(path):
+# История чата хранится в chat_{id}.jsonl, по одной записи на строку:
+#   {"u": "...", "a": "...", "p": "buyer"} — пара вопрос-ответ и id системного промпта
+#   {"r": 1}                               — сброс контекста
+#   {"s": "...", "k": 3}                   — сводка всех предыдущих пар, кроме последних k
+# Текст системного промпта в истории не хранится.
+# При общем бэкенде состояния (Redis) те же записи хранятся в списке history:{id}.
+
+_TAIL_BLOCK_SIZE = 8192
+
+def _history_path(chat_id: int) -> str:
+    return os.path.join(settings.history_dir, f"chat_{chat_id}.jsonl")
+
+def _legacy_history_path(chat_id: int) -> str:
+    return os.path.join(settings.history_dir, f"chat_{chat_id}.json")
+
+def _encode(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+def _turns_to_messages(records: List[dict], max_pairs: Optional[int]) -> list:
+    """Превратить записи в сообщения после последнего сброса контекста: сводку и пары user/assistant"""
+    turns = []
+    summary = None
+    for record in records:
+        if record.get("r"):
+            turns = []
+            summary = None
+        elif "s" in record:
+            # Пары, дописанные пока готовилась сводка, в нее не вошли
+            kept = record.get("k", 0)
+            turns = turns[-kept:] if kept > 0 else []
+            summary = record["s"]
+        elif "u" in record:
+            turns.append(record)
+    if max_pairs is not None:
+        turns = turns[-max_pairs:] if max_pairs > 0 else []
+
+    messages = []
+    if summary:
+        messages.append({"role": "summary", "content": summary})
+    for turn in turns:
+        messages.append({"role": "user", "content": turn["u"]})
+        messages.append({"role": "assistant", "content": turn["a"]})
+    return messages
+
+def _messages_to_records(history: list, prompt_id: Optional[str] = None) -> List[dict]:
+    """Собрать пары вопрос-ответ из списка сообщений"""
+    records = []
+    question = None
+    for msg in history:
+        if msg.get("role") == "summary":
+            records.append({"s": msg.get("content", ""), "k": 0})
+        elif msg.get("role") == "user":
+            question = msg.get("content", "")
+        elif msg.get("role") == "assistant" and question is not None:
+            records.append({"u": question, "a": msg.get("content", ""), "p": prompt_id})
+            question = None
+    return records
+
+async def _read_tail(path: str, max_records: int) -> List[dict]:
+    """Прочитать последние записи файла, читая его блоками с конца"""
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(0, os.SEEK_END)
+        position = await f.tell()
+        data = b""
+        # +1 строка на случай оборванной первой строки в прочитанном блоке
+        while position > 0 and data.count(b"\n") <= max_records:
+            step = min(_TAIL_BLOCK_SIZE, position)
+            position -= step
+            await f.seek(position)
+            data = await f.read(step) + data
+
+    lines = data.split(b"\n")
+    if position > 0:
+        lines = lines[1:]
+
+    records = []
+    for line in lines[-(max_records + 1):]:
+        if not line.strip():
+            continue
         try:
-            async with aiofiles.open(path, "r", encoding="utf-8") as f:
-                content = await f.read()
-                return json.loads(content) if content.strip() else []
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            # Оборванная строка после аварийного завершения
+            continue
+    return records[-max_records:]
+
+def _has_marker(records: List[dict]) -> bool:
+    """Есть ли среди записей сводка или сброс контекста: более ранние записи не нужны"""
+    return any(record.get("r") or "s" in record for record in records)
+
+async def _migrate_legacy(chat_id: int) -> bool:
+    """Перенести историю из старого формата chat_{id}.json в JSONL"""
+    legacy_path = _legacy_history_path(chat_id)
+    if not os.path.exists(legacy_path):
+        return False
+    try:
+        async with aiofiles.open(legacy_path, "r", encoding="utf-8") as f:
+            content = await f.read()
+        history = json.loads(content) if content.strip() else []
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке истории: {e}")
+        return False
+
+    await save_history(chat_id, history)
+    logger.info(f"✅ История чата {chat_id} перенесена в формат JSONL")
+    return True
+
+async def _read_stored(chat_id: int, max_pairs: int) -> List[dict]:
+    """Последние записанные записи чата, достаточные для max_pairs пар"""
+    path = _history_path(chat_id)
+    records = []
+    # Запас записей нужен, чтобы увидеть сброс контекста или сводку перед хвостом
+    max_records = max_pairs + settings.summary_trigger_pairs + 1
+    try:
+        if state_backend.shared or os.path.exists(path) or await _migrate_legacy(chat_id):
+            while True:
+                if state_backend.shared:
+                    records = [json.loads(line) for line in await state_backend.tail(f"history:{chat_id}", max_records)]
+                else:
+                    records = await _read_tail(path, max_records)
+                # Если сжатие истории раз за разом не удавалось, последняя сводка лежит дальше хвоста.
+                # Ищем ее, расширяя окно, но не дальше history_max_records записей
+                if (not settings.summary_enabled or len(records) < max_records or _has_marker(records)
+                        or max_records >= settings.history_max_records):
+                    break
+                max_records = min(max_records * 2, settings.history_max_records)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке истории: {e}")
+    return records
+
+async def load_history(chat_id: int, max_pairs: Optional[int] = None) -> list:
+    """Загрузить сводку и последние max_pairs пар вопрос-ответ (без системного промпта)"""
+    max_pairs = settings.max_history_pairs if max_pairs is None else max_pairs
+    started = time.perf_counter()
+    records = await history_writer.read(chat_id, lambda: _read_stored(chat_id, max_pairs))
+    HISTORY_SECONDS.observe(time.perf_counter() - started, "load")
+    return _turns_to_messages(records, max_pairs)
+
+async def save_history(chat_id: int, history: list, prompt_id: Optional[str] = None):
+    """Полностью перезаписать историю чата (атомарно, через временный файл)"""
+    started = time.perf_counter()
+    try:
+        await _save_history(chat_id, history, prompt_id)
+    finally:
+        HISTORY_SECONDS.observe(time.perf_counter() - started, "save")
+
+async def _save_history(chat_id: int, history: list, prompt_id: Optional[str]):
+    if state_backend.shared:
+        try:
+            await state_backend.delete(f"history:{chat_id}")
+            await _append_records(chat_id, _messages_to_records(history, prompt_id))
         except Exception as e:
-            logger.error(f"Ошибка при загрузке истории: {e}")
-    return []
+            logger.error(f"❌ Ошибка при сохранении истории: {e}")
+        return
 
-async def save_history(chat_id: int, history: list):
-    path = os.path.join(settings.history_dir, f"chat_{chat_id}.json")
+    path = _history_path(chat_id)
+    tmp_path = f"{path}.tmp"
     try:
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        async with aiofiles.open(path, "w", encoding="utf-8") as f:
-            await f.write(json.dumps(history, ensure_ascii=False, indent=2))
+        content = "".join(_encode(record) for record in _messages_to_records(history, prompt_id))
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+            await f.write(content)
+        os.replace(tmp_path, path)
     except Exception as e:
-        logger.error(f"❌ Ошибка при сохранении истории: {e}")
\ No newline at end of file
+        logger.error(f"❌ Ошибка при сохранении истории: {e}")
+
+async def _append_records(chat_id: int, records: List[dict]):
+    started = time.perf_counter()
+    try:
+        if state_backend.shared:
+            lines = [json.dumps(record, ensure_ascii=False) for record in records]
+            await state_backend.append(f"history:{chat_id}", lines, settings.history_max_records)
+            return
+        path = _history_path(chat_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        async with aiofiles.open(path, "a", encoding="utf-8") as f:
+            await f.write("".join(_encode(record) for record in records))
+    finally:
+        HISTORY_SECONDS.observe(time.perf_counter() - started, "append")
+
+class HistoryWriter:
+    """Отложенная дозапись истории чатов.
+
+    Новые записи накапливаются в буфере чата и раз в `history_flush_interval`
+    секунд дописываются в конец файла одной операцией на чат. Стоимость
+    записи пропорциональна размеру новых реплик, а не всей истории.
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        self.flush_interval = settings.history_flush_interval if flush_interval is None else flush_interval
+        if state_backend.shared:
+            # Другие процессы должны сразу видеть новые записи: пишем без задержки
+            self.flush_interval = 0
+        self._pending: Dict[int, List[dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _schedule(self, chat_id: int, record: dict):
+        self._pending.setdefault(chat_id, []).append(record)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def append_turn(self, chat_id: int, user_message: str, response: str, prompt_id: Optional[str] = None):
+        """Добавить пару вопрос-ответ"""
+        self._schedule(chat_id, {"u": user_message, "a": response, "p": prompt_id})
+
+    def append_reset(self, chat_id: int):
+        """Отметить сброс контекста: более ранние записи не загружаются"""
+        self._schedule(chat_id, {"r": 1})
+
+    def append_summary(self, chat_id: int, summary: str, kept_pairs: int):
+        """Заменить все пары, кроме последних kept_pairs, сводкой"""
+        self._schedule(chat_id, {"s": summary, "k": kept_pairs})
+
+    def pending(self, chat_id: int) -> List[dict]:
+        """Записи чата, еще не записанные на диск"""
+        return list(self._pending.get(chat_id, ()))
+
+    async def read(self, chat_id: int, read_stored: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        """Прочитать записанные записи чата функцией read_stored и дописать к ним еще не записанные.
+
+        Чтение идет под блокировкой дозаписи: иначе записи, дописанные во время
+        чтения, не попали бы ни в прочитанный хвост, ни в буфер.
+        """
+        async with self._lock:
+            records = await read_stored()
+            # Еще не записанные записи новее записанных
+            return records + self.pending(chat_id)
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Дописать все накопленные записи"""
+        async with self._lock:
+            for chat_id in list(self._pending):
+                records = self._pending.pop(chat_id, None)
+                if not records:
+                    continue
+                try:
+                    await _append_records(chat_id, records)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка при сохранении истории: {e}")
+                    # Возвращаем записи в начало очереди, чтобы не потерять порядок
+                    self._pending[chat_id] = records + self._pending.get(chat_id, [])
+
+    async def commit(self, chat_id: int):
+        """При общем бэкенде — сразу записать новые записи чата, чтобы их увидели другие процессы"""
+        if not state_backend.shared or chat_id not in self._pending:
+            return
+        async with self._lock:
+            records = self._pending.pop(chat_id, None)
+            if not records:
+                return
+            try:
+                await _append_records(chat_id, records)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при сохранении истории: {e}")
+                self._pending[chat_id] = records + self._pending.get(chat_id, [])
+
+    async def close(self):
+        """Остановить фоновую запись и сохранить оставшиеся записи"""
+        if self._task is not None:
+            # Дожидаемся текущей записи, чтобы не прервать ее на середине
+            async with self._lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+# Глобальный экземпляр записи истории
+history_writer = HistoryWriter()
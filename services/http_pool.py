@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import importlib.util
+import time
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# HTTP/2 требует пакет h2 (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Тело ответа, при закрытии которого соединение считается освобожденным"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, transport: "PooledTransport"):
+        self._stream = stream
+        self._transport = transport
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._transport.in_flight -= 1
+        await self._stream.aclose()
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """Транспорт httpx со статистикой использования пула соединений.
+
+    Новые соединения считаются через расширение `trace` httpcore. Число
+    открытых сейчас соединений httpcore наружу не отдает, поэтому читается из
+    пула, только если у него есть атрибут `connections`.
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool = False, **kwargs):
+        super().__init__(limits=limits, http2=http2, **kwargs)
+        self.max_connections = limits.max_connections
+        self.http2 = http2
+        self.in_flight = 0     # Запросов в работе, включая ожидающих соединения
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.waits = 0         # Запросов, которым не хватило свободного соединения
+        self.connections_opened = 0
+        self.last_request_at = 0.0
+
+    async def _trace(self, event: str, info: dict, inner: Optional[Callable[[str, dict], Awaitable]] = None):
+        if event == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        if inner is not None:
+            await inner(event, info)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions = {
+            **request.extensions,
+            "trace": functools.partial(self._trace, inner=request.extensions.get("trace")),
+        }
+        self.requests += 1
+        self.last_request_at = time.monotonic()
+        # По HTTP/2 запросы мультиплексируются и не ждут отдельного соединения
+        if not self.http2 and self.max_connections and self.in_flight >= self.max_connections:
+            self.waits += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        response.stream = _TrackedStream(response.stream, self)
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        stats = {
+            "connections_opened": self.connections_opened,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests": self.requests,
+            "waits": self.waits,
+        }
+        connections = getattr(getattr(self, "_pool", None), "connections", None)
+        if connections is not None:
+            idle = sum(1 for connection in connections if connection.is_idle())
+            stats.update(connections=len(connections), active=len(connections) - idle, idle=idle)
+        return stats
+
+def create_pooled_transport() -> PooledTransport:
+    """Транспорт с настроенным пулом соединений для запросов к Yandex Cloud"""
+    http2 = settings.llm_http2 and HTTP2_AVAILABLE
+    if settings.llm_http2 and not HTTP2_AVAILABLE:
+        logger.warning("⚠️ Пакет h2 не установлен, запросы к LLM идут по HTTP/1.1")
+
+    limits = httpx.Limits(
+        max_connections=settings.llm_pool_max_connections,
+        max_keepalive_connections=settings.llm_pool_max_keepalive,
+        keepalive_expiry=settings.llm_pool_keepalive_expiry,
+    )
+    return PooledTransport(limits=limits, http2=http2)
+
+def create_http_client(timeout: float, transport: Optional[PooledTransport] = None) -> httpx.AsyncClient:
+    """HTTP-клиент поверх transport (по умолчанию — нового пула соединений)"""
+    return httpx.AsyncClient(timeout=timeout, transport=transport or create_pooled_transport())
+
+class ConnectionWarmer:
+    """Прогрев соединений при запуске и поддержание их открытыми в простое.
+
+    Прогрев — легкий GET к хосту API: он устанавливает TCP- и TLS-соединение,
+    но не расходует квоту модели. Пока запросов нет дольше `interval` секунд,
+    такой же запрос повторяется, чтобы соединение не закрылось по keep-alive.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, interval: float,
+                 transport: Optional[PooledTransport] = None):
+        self.client = client
+        self.url = url
+        self.interval = interval
+        # Транспорт клиента, если он наш: по нему видно, давно ли были запросы
+        self._transport = transport
+        self._task: Optional[asyncio.Task] = None
+
+    async def _ping(self):
+        try:
+            response = await self.client.get(self.url)
+            await response.aclose()
+        except httpx.HTTPError as e:
+            logger.warning(f"⚠️ Не удалось прогреть соединение с {self.url}: {e}")
+
+    async def prewarm(self, connections: int = 1):
+        """Открыть заранее `connections` соединений"""
+        transport = self._transport
+        if transport is not None and transport.http2:
+            connections = 1  # Одного соединения HTTP/2 достаточно
+        started = time.monotonic()
+        await asyncio.gather(*(self._ping() for _ in range(max(1, connections))))
+        logger.info(f"🔥 Соединения с {self.url} прогреты за {time.monotonic() - started:.2f} с")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            transport = self._transport
+            idle_for = time.monotonic() - transport.last_request_at if transport else self.interval
+            if idle_for >= self.interval:
+                await self._ping()
+
+    def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,172 @@
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+KEEPALIVE_TIMEOUT = 75.0
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]  # Имена заголовков в нижнем регистре
+    body: bytes
+
+class Response(NamedTuple):
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+    @classmethod
+    def json(cls, data, status: int = 200) -> "Response":
+        return cls(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        self.status = status
+
+class HTTPServer:
+    """Минимальный асинхронный HTTP/1.1-сервер на asyncio для webhook и служебных эндпоинтов.
+
+    Поддерживает keep-alive и тело с Content-Length. При остановке перестает
+    принимать соединения, отвечает 503 на новые запросы и дожидается уже
+    начатых обработчиков.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.draining = False
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def route(self, method: str, path: str, handler: Handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # При порте 0 система выбирает свободный порт
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"🌐 HTTP-сервер слушает {self.host}:{self.port}")
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise _BadRequest(413)
+        if len(head) > MAX_HEADER_BYTES:
+            raise _BadRequest(413)
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise _BadRequest(400)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise _BadRequest(400)
+        if length < 0:
+            raise _BadRequest(400)
+        if length > MAX_BODY_BYTES:
+            raise _BadRequest(413)
+        try:
+            body = await reader.readexactly(length) if length else b""
+        except asyncio.IncompleteReadError:
+            return None
+        return Request(method.upper(), target.split("?", 1)[0], headers, body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        if self.draining:
+            return Response(503, b"shutting down")
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self._routes)
+            return Response(405 if known_path else 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки {request.method} {request.path}: {e}", exc_info=True)
+            return Response(500)
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        reason = REASONS.get(response.status, "")
+        head = (
+            f"HTTP/1.1 {response.status} {reason}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except _BadRequest as e:
+                    await self._write(writer, Response(e.status), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                self._in_flight += 1
+                self._idle.clear()
+                try:
+                    response = await self._dispatch(request)
+                finally:
+                    self._in_flight -= 1
+                    if not self._in_flight:
+                        self._idle.set()
+
+                keep_alive = request.headers.get("connection", "").lower() != "close" and not self.draining
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Перестать принимать запросы и дождаться завершения начатых"""
+        if self._server is None:
+            return
+        self.draining = True
+        self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не дождались завершения {self._in_flight} HTTP-запросов")
+        # Закрываем простаивающие keep-alive соединения
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        logger.info("✅ HTTP-сервер остановлен")
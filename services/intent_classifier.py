@@ -0,0 +1,99 @@
+import os
+import zlib
+from typing import Iterable, List, Optional, Tuple
+from utils.helpers import tokenize
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+try:
+    import numpy as np
+except ImportError:  # numpy — опциональная зависимость
+    np = None
+
+NGRAM_SIZES = (2, 3, 4)
+# Масштаб среднего логарифма правдоподобия n-граммы при расчете уверенности
+CONFIDENCE_SCALE = 10.0
+
+def char_ngrams(text: str) -> List[str]:
+    """Символьные n-граммы слов текста с границами слова: «<уч», «уча», ..."""
+    ngrams = []
+    for word in tokenize(text):
+        padded = f"<{word.replace('ё', 'е')}>"
+        for size in NGRAM_SIZES:
+            ngrams.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return ngrams
+
+class IntentClassifier:
+    """Мультиномиальный наивный байесовский классификатор интентов.
+
+    Признаки — хэшированные символьные n-граммы, поэтому словарь не нужен, а
+    опечатки и формы слов дают близкие признаки. Оценка сообщения — одно
+    произведение разреженного вектора n-грамм на матрицу логарифмов
+    вероятностей (интенты × признаки).
+    """
+
+    def __init__(self, intents: List[str], log_prior: "np.ndarray", log_prob: "np.ndarray"):
+        self.intents = list(intents)
+        self.log_prior = log_prior
+        self.log_prob = log_prob
+        self.dim = log_prob.shape[1]
+
+    @staticmethod
+    def features(text: str, dim: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Номера хэшированных признаков текста и их количества"""
+        ngrams = char_ngrams(text)
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) % dim for g in ngrams), dtype=np.int64, count=len(ngrams))
+        return np.unique(hashes, return_counts=True)
+
+    @classmethod
+    def train(cls, samples: Iterable[Tuple[str, str]], dim: int = 1 << 16, alpha: float = 0.5) -> "IntentClassifier":
+        """Обучить на парах (текст, интент); alpha — сглаживание Лапласа"""
+        samples = list(samples)
+        intents = sorted({intent for _, intent in samples})
+        index = {intent: i for i, intent in enumerate(intents)}
+
+        counts = np.zeros((len(intents), dim), dtype=np.float64)
+        docs = np.zeros(len(intents), dtype=np.float64)
+        for text, intent in samples:
+            features, feature_counts = cls.features(text, dim)
+            counts[index[intent], features] += feature_counts
+            docs[index[intent]] += 1
+
+        log_prior = np.log(docs / docs.sum())
+        smoothed = counts + alpha
+        log_prob = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        return cls(intents, log_prior.astype(np.float32), log_prob.astype(np.float32))
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """Наиболее вероятный интент и уверенность в нем от 0 до 1"""
+        features, counts = self.features(text, self.dim)
+        if not len(features):
+            return None, 0.0
+        counts = counts.astype(np.float32)
+        # Правдоподобие усредняется по n-граммам: иначе уверенность растет с длиной
+        # сообщения и почти всегда близка к 1
+        likelihood = self.log_prob[:, features] @ counts / counts.sum()
+        scores = self.log_prior + likelihood * CONFIDENCE_SCALE
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.intents[best], float(probabilities[best])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, intents=np.array(self.intents), log_prior=self.log_prior, log_prob=self.log_prob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IntentClassifier"]:
+        """Загрузить модель; None, если файла нет или numpy не установлен"""
+        if np is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls([str(i) for i in data["intents"]], data["log_prior"], data["log_prob"])
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить модель интентов {path}: {e}")
+            return None
@@ -1,25 +1,118 @@
 import os
 import json
-from typing import Dict, List
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 from config import settings
+from services.intent_classifier import IntentClassifier
+from utils.helpers import stem_ru, tokenize
 from utils.logger import setup_logger
 
 logger = setup_logger()
 
+# Ключевые слова интента: список или словарь {слово: вес}
+KeywordSpec = Union[List[str], Dict[str, float]]
+
+# Минимальная длина основы, с которой ключевое слово ищется как начало слова
+MIN_PREFIX_LEN = 3
+
+class KeywordMatcher(NamedTuple):
+    """Скомпилированный словарь ключевых слов.
+
+    Каждое ключевое слово приводится к основе; основа сопоставляется с
+    началом основы слова сообщения, как раньше подстрока «инвест» находила
+    «инвестиции». Поиск — O(длина слова) обращений к словарю на слово,
+    независимо от числа ключевых слов.
+    """
+
+    intents: Tuple[str, ...]
+    # основа -> ((номер ключевого слова, интент, вес), ...)
+    words: Dict[str, Tuple[Tuple[int, str, float], ...]]
+    # фраза из основ -> ((номер ключевого слова, интент, вес), ...)
+    phrases: Dict[Tuple[str, ...], Tuple[Tuple[int, str, float], ...]]
+    max_phrase_len: int
+
+    @classmethod
+    def compile(cls, prompt_map: Dict[str, KeywordSpec]) -> "KeywordMatcher":
+        words: Dict[str, Dict[str, Tuple[int, str, float]]] = {}
+        phrases: Dict[Tuple[str, ...], Dict[str, Tuple[int, str, float]]] = {}
+        keyword_id = 0
+        for intent, keywords in prompt_map.items():
+            weighted = keywords.items() if isinstance(keywords, dict) else ((kw, 1.0) for kw in keywords)
+            for keyword, weight in weighted:
+                stems = tuple(stem_ru(word) for word in tokenize(keyword))
+                if not stems:
+                    continue
+                # Формы одного слова («участок», «участки») дают одну основу и считаются один раз
+                table = words.setdefault(stems[0], {}) if len(stems) == 1 else phrases.setdefault(stems, {})
+                previous = table.get(intent)
+                if previous is None or previous[2] < weight:
+                    table[intent] = (keyword_id, intent, float(weight))
+                    keyword_id += 1
+        return cls(
+            intents=tuple(prompt_map),
+            words={stem: tuple(entries.values()) for stem, entries in words.items()},
+            phrases={stems: tuple(entries.values()) for stems, entries in phrases.items()},
+            max_phrase_len=max((len(stems) for stems in phrases), default=0),
+        )
+
+    def scores(self, text: str) -> Dict[str, float]:
+        stems = [stem_ru(word) for word in tokenize(text)]
+        matched = {}
+        for stem in stems:
+            for end in range(MIN_PREFIX_LEN, len(stem) + 1):
+                for entry in self.words.get(stem[:end], ()):
+                    matched[entry[0]] = entry
+            # Основы короче минимальной длины сравниваются целиком
+            if len(stem) < MIN_PREFIX_LEN:
+                for entry in self.words.get(stem, ()):
+                    matched[entry[0]] = entry
+
+        for size in range(2, self.max_phrase_len + 1):
+            for start in range(len(stems) - size + 1):
+                for entry in self.phrases.get(tuple(stems[start:start + size]), ()):
+                    matched[entry[0]] = entry
+
+        scores = dict.fromkeys(self.intents, 0.0)
+        for _, intent, weight in matched.values():
+            scores[intent] += weight
+        return scores
+
+class IntentResult(NamedTuple):
+    intent: str
+    confidence: float
+    source: str  # classifier, keywords или previous
+
 class IntentRecognizer:
-    def __init__(self, prompts_dir: str = "prompts"):
+    def __init__(self, prompts_dir: str = "prompts", check_interval: Optional[float] = None):
         self.prompts_dir = prompts_dir
+        self.map_path = os.path.join(prompts_dir, "prompt_map.json")
+        self.check_interval = settings.prompt_map_check_interval if check_interval is None else check_interval
+        self._checked_at = 0.0
+        self._mtime_ns: Optional[int] = None
         self.prompt_map = self._load_prompt_map()
-        
-    def _load_prompt_map(self) -> Dict[str, List[str]]:
+        self.matcher = KeywordMatcher.compile(self.prompt_map)
+
+        self.model_path = settings.intent_model_file
+        self._model_mtime_ns = self._model_mtime()
+        self.classifier = IntentClassifier.load(self.model_path) if settings.intent_classifier_enabled else None
+        if self.classifier is not None:
+            logger.info(f"✅ Модель интентов загружена: {self.classifier.intents}")
+
+    def _model_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.model_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_prompt_map(self) -> Dict[str, KeywordSpec]:
         try:
-            map_path = os.path.join(self.prompts_dir, "prompt_map.json")
-            if os.path.exists(map_path):
-                with open(map_path, "r", encoding="utf-8") as f:
+            if os.path.exists(self.map_path):
+                self._mtime_ns = os.stat(self.map_path).st_mtime_ns
+                with open(self.map_path, "r", encoding="utf-8") as f:
                     return json.load(f)
         except Exception as e:
             logger.error(f"❌ Не удалось загрузить prompt_map.json: {e}")
-        
+
         # Fallback mapping
         return {
             "buyer": ["купить", "участок", "земля", "дом", "цена", "стоимость", "покупка"],
@@ -27,18 +120,69 @@ class IntentRecognizer:
             "partner": ["партнёр", "сотрудничество", "совместный", "предложение", "коллаборация"],
             "general": ["что", "расскажи", "проект", "информация", "подробнее", "общее"]
         }
-    
-    def determine_intent(self, user_message: str) -> str:
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать prompt_map.json, если файл изменился. Возвращает True при обновлении"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        if settings.intent_classifier_enabled:
+            model_mtime_ns = self._model_mtime()
+            if model_mtime_ns is not None and model_mtime_ns != self._model_mtime_ns:
+                classifier = IntentClassifier.load(self.model_path)
+                if classifier is not None:
+                    self.classifier, self._model_mtime_ns = classifier, model_mtime_ns
+                    logger.info("🔄 Модель интентов перечитана")
+
+        try:
+            mtime_ns = os.stat(self.map_path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime_ns == self._mtime_ns:
+            return False
+
+        try:
+            with open(self.map_path, "r", encoding="utf-8") as f:
+                prompt_map = json.load(f)
+            matcher = KeywordMatcher.compile(prompt_map)
+        except Exception as e:
+            # Недописанный или ошибочный файл: продолжаем работать со старым словарем
+            logger.error(f"❌ Не удалось перечитать prompt_map.json: {e}")
+            return False
+
+        # Новый словарь собран заранее и подменяется без await: обработчики видят либо старый, либо новый целиком
+        self.prompt_map, self.matcher, self._mtime_ns = prompt_map, matcher, mtime_ns
+        logger.info(f"🔄 prompt_map.json перечитан: {sum(len(kw) for kw in prompt_map.values())} ключевых слов")
+        return True
+
+    def classify(self, user_message: str, previous_intent: Optional[str] = None) -> IntentResult:
+        """
+        Определить интент с уверенностью. Сначала модель, затем ключевые слова;
+        интент, выбранный ранее в диалоге, остается, только если модель не
+        уверена и ни одно ключевое слово не найдено.
+        """
         user_message = user_message.lower().strip()
         if not user_message:
-            return "general"
-        
-        scores = {}
-        for intent_type, keywords in self.prompt_map.items():
-            scores[intent_type] = sum(1 for kw in keywords if kw in user_message)
-        
-        # Если ни один интент не набрал очков, возвращаем general
-        if max(scores.values()) == 0:
-            return "general"
-            
-        return max(scores, key=scores.get)
\ No newline at end of file
+            return IntentResult(previous_intent or "general", 0.0, "previous")
+
+        self.reload_if_changed()
+        if self.classifier is not None:
+            intent, confidence = self.classifier.predict(user_message)
+            if intent is not None and confidence >= settings.intent_min_confidence:
+                return IntentResult(intent, confidence, "classifier")
+
+        scores = self.matcher.scores(user_message)
+        total = sum(scores.values())
+        # Если ни один интент не набрал очков, остаемся в прежнем интенте или возвращаем general
+        if not total:
+            return IntentResult(previous_intent or "general", 0.0, "previous")
+
+        intent = max(scores, key=scores.get)
+        return IntentResult(intent, scores[intent] / total, "keywords")
+
+    def determine_intent(self, user_message: str, previous_intent: Optional[str] = None) -> str:
+        result = self.classify(user_message, previous_intent)
+        logger.debug(f"Интент: {result.intent} ({result.source}, уверенность {result.confidence:.2f})")
+        return result.intent
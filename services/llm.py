@@ -1,38 +1,142 @@
 import httpx
-import os
 import json
-from typing import List, Dict
+import time
+import random
+import asyncio
+import functools
+from collections import deque
+from contextlib import AsyncExitStack, aclosing
+from typing import AsyncIterator, Awaitable, Callable, Deque, Hashable, List, Dict, Optional, Tuple, TypeVar
 from config import settings
 from utils.logger import setup_logger
 from services.intent_recognizer import IntentRecognizer  # Добавляем импорт
+from services.prompt_registry import Prompt, PromptRegistry
+from services.context_builder import ContextBuilder, TokenCounter
+from services.http_pool import ConnectionWarmer, create_http_client, create_pooled_transport
+from services.llm_scheduler import FairScheduler, TokenBucket
+from services.retrieval import document_index, format_passages
+from services.metrics import LLM_FIRST_CHUNK_SECONDS, LLM_REQUEST_SECONDS, LLM_RESPONSES
 
 logger = setup_logger()
 
+T = TypeVar("T")
+
+def _transport_status(e: httpx.TransportError) -> str:
+    """Метка статуса для запроса, на который не пришел HTTP-ответ"""
+    return "timeout" if isinstance(e, httpx.TimeoutException) else "network_error"
+
+def _stream_text(line: str) -> str:
+    return json.loads(line)["result"]["alternatives"][0]["message"]["text"]
+
+async def _close_stream(opened: Tuple[AsyncExitStack, AsyncIterator[str], Optional[str]]):
+    await opened[0].aclose()
+
+def _discard_attempt(task: asyncio.Task, discard: Optional[Callable[[object], Awaitable]] = None):
+    """Забрать итог проигравшей попытки дублированного запроса, чтобы asyncio не ругался на
+    непрочитанное исключение, и освободить ее результат, если она все-таки успела"""
+    if task.cancelled():
+        return
+    if task.exception() is None and discard is not None:
+        asyncio.ensure_future(discard(task.result()))
+
 class PromptManager:
     def __init__(self, prompts_dir: str = "prompts"):
         self.prompts_dir = prompts_dir
         self.intent_recognizer = IntentRecognizer(prompts_dir)
-        self._prompt_cache = {}  # Кэш промптов
-        
+        # Все промпты загружаются сразу и перечитываются при изменении файлов
+        self.registry = PromptRegistry(prompts_dir)
+
+    def get(self, intent_type: str) -> Prompt:
+        """Промпт интента с версией и готовым системным сообщением"""
+        return self.registry.get(intent_type)
+
     def get_prompt(self, intent_type: str) -> str:
-        """Получить промпт по типу интента с кэшированием"""
-        if intent_type in self._prompt_cache:
-            return self._prompt_cache[intent_type]
-            
-        path = os.path.join(self.prompts_dir, f"{intent_type}.txt")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                prompt = f.read().strip()
-                self._prompt_cache[intent_type] = prompt
-                return prompt
-        except FileNotFoundError:
-            logger.warning(f"⚠️ Файл промпта не найден: {path}")
-            # Fallback на general промпт
-            return self.get_prompt("general")
+        """Получить текст промпта по типу интента"""
+        return self.registry.get(intent_type).text
     
-    def determine_intent(self, user_message: str) -> str:
+    def determine_intent(self, user_message: str, previous_intent: Optional[str] = None) -> str:
         """Определить интент пользовательского сообщения"""
-        return self.intent_recognizer.determine_intent(user_message)
+        return self.intent_recognizer.determine_intent(user_message, previous_intent)
+
+class LLMError(Exception):
+    """Ошибка запроса к LLM; user_message — текст для пользователя. Такие ответы не кэшируются"""
+
+    def __init__(self, user_message: str):
+        super().__init__(user_message)
+        self.user_message = user_message
+
+class LLMUnavailableError(LLMError):
+    """LLM считается недоступной: запрос отклонен без обращения к API"""
+
+    def __init__(self):
+        super().__init__(
+            "⏳ Сервис ответов сейчас перегружен. Попробуйте, пожалуйста, через минуту — "
+            "а пока можно посмотреть документы проекта."
+        )
+
+class CircuitBreaker:
+    """Размыкатель цепи для запросов к LLM.
+
+    После `failure_threshold` ошибок подряд (медленный ответ тоже считается
+    ошибкой) цепь размыкается, и запросы сразу отклоняются. Через `open_sec`
+    секунд пропускается один пробный запрос: успех замыкает цепь, ошибка
+    снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, open_sec: float, slow_call_sec: float = 0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_sec = open_sec
+        self.slow_call_sec = slow_call_sec
+        self.state = self.CLOSED
+        self.rejected = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.open_sec:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("🟡 Проверяем доступность LLM пробным запросом")
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        if self.slow_call_sec and latency > self.slow_call_sec:
+            logger.warning(f"⚠️ Медленный ответ LLM: {latency:.1f} с")
+            self.record_failure()
+            return
+        self._failures = 0
+        self._probe_in_flight = False
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            logger.info("🟢 LLM снова доступна, цепь замкнута")
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.error(f"🔴 LLM недоступна, запросы отклоняются на {self.open_sec:.0f} с")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def release(self):
+        """Запрос завершился без результата (например, отменен): освободить пробный слот"""
+        self._probe_in_flight = False
 
 class YandexAPIClient:
     def __init__(self):
@@ -44,76 +148,379 @@ class YandexAPIClient:
             "Authorization": f"Api-Key {self.api_key}",
             "Content-Type": "application/json",
         }
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.transport = create_pooled_transport()
+        self.client = create_http_client(settings.llm_timeout, self.transport)
+        self.warmer = ConnectionWarmer(
+            self.client, "https://llm.api.cloud.yandex.net/", settings.llm_keep_warm_interval, self.transport
+        )
+        # Ограничения под квоту Yandex: одновременные запросы и частота
+        self.scheduler = FairScheduler(settings.llm_max_concurrency)
+        self.rate_limiter = TokenBucket(settings.llm_rate_per_sec, settings.llm_rate_burst)
+        # Подсчет токенов не должен расходовать квоту запросов к модели
+        self.tokenize_limiter = TokenBucket(settings.llm_tokenize_rate_per_sec, settings.llm_rate_burst)
+        self.breaker = CircuitBreaker(
+            settings.llm_breaker_failure_threshold,
+            settings.llm_breaker_open_sec,
+            settings.llm_breaker_slow_call_sec,
+        )
+        # Фоновые запросы (сжатие истории) идут к другой модели: их сбои не должны отклонять вопросы пользователей
+        self.background_breaker = CircuitBreaker(
+            settings.llm_breaker_failure_threshold,
+            settings.llm_breaker_open_sec,
+            settings.llm_breaker_slow_call_sec,
+        )
+        # Задержки успешных запросов и первых частей потока для оценки p95 при дублировании
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self._first_chunk_latencies: Deque[float] = deque(maxlen=200)
+        self.hedged_requests = 0
+        self.hedge_wins = 0  # Дублирующие запросы, ответившие раньше исходных
     
+    async def warm_up(self):
+        """Заранее открыть соединения с API и поддерживать их открытыми"""
+        await self.warmer.prewarm(settings.llm_pool_prewarm)
+        self.warmer.start()
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Статистика пула соединений"""
+        return self.transport.stats()
+
     async def close(self):
         """Закрыть HTTP-клиент"""
+        await self.warmer.close()
         await self.client.aclose()
+
+    @property
+    def queue_depth(self) -> int:
+        """Число запросов, ожидающих своей очереди"""
+        return self.scheduler.queue_depth
     
-    async def make_request(self, messages: List[Dict]) -> str:
-        """Выполнить запрос к Yandex API"""
-        payload = {
-            "modelUri": self.model_uri,
+    def _build_payload(self, messages: List[Dict], stream: bool = False,
+                       model: Optional[str] = None, max_tokens: Optional[int] = None) -> Dict:
+        return {
+            "modelUri": f"gpt://{self.folder_id}/{model}/latest" if model else self.model_uri,
             "completionOptions": {
+                "stream": stream,
                 "temperature": settings.llm_temperature,
-                "maxTokens": settings.llm_max_tokens
+                "maxTokens": max_tokens or settings.llm_max_tokens
             },
             "messages": messages
         }
 
-        try:
-            response = await self.client.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data["result"]["alternatives"][0]["message"]["text"].strip()
-        except httpx.ConnectError:
+    async def tokenize(self, text: str) -> int:
+        """Точное число токенов текста по токенизатору модели"""
+        await self.tokenize_limiter.acquire()
+        response = await self.client.post(
+            "https://llm.api.cloud.yandex.net/foundationModels/v1/tokenize",
+            headers=self.headers,
+            json={"modelUri": self.model_uri, "text": text},
+        )
+        response.raise_for_status()
+        return len(response.json()["tokens"])
+
+    @staticmethod
+    def _is_retryable(e: Exception) -> bool:
+        if isinstance(e, httpx.HTTPStatusError):
+            return e.response.status_code == 429 or e.response.status_code >= 500
+        return isinstance(e, httpx.TransportError)
+
+    @staticmethod
+    def _backoff_delay(attempt: int, e: Exception) -> float:
+        """Экспоненциальная задержка со случайным разбросом; Retry-After от сервера имеет приоритет"""
+        if isinstance(e, httpx.HTTPStatusError):
+            retry_after = e.response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), settings.llm_backoff_max)
+        delay = min(settings.llm_backoff_max, settings.llm_backoff_base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def _to_llm_error(e: Exception) -> LLMError:
+        """Залогировать ошибку запроса и преобразовать ее в LLMError с текстом для пользователя"""
+        if isinstance(e, httpx.ConnectError):
             logger.error("🔴 Не удалось подключиться к Yandex LLM")
-            return "Не удалось подключиться к ИИ. Проверьте интернет."
-        except httpx.HTTPStatusError as e:
+            return LLMError("Не удалось подключиться к ИИ. Проверьте интернет.")
+        if isinstance(e, httpx.HTTPStatusError):
             status = e.response.status_code
             if status == 401:
                 logger.error("🔴 Ошибка аутентификации: неверный YA_API_KEY")
-                return "Ошибка: неверный API-ключ. Проверьте YA_API_KEY."
+                return LLMError("Ошибка: неверный API-ключ. Проверьте YA_API_KEY.")
             elif status == 429:
                 logger.error("🔴 Слишком много запросов к LLM")
-                return "Слишком много запросов. Попробуйте позже."
+                return LLMError("Слишком много запросов. Попробуйте позже.")
             else:
                 logger.error(f"🔴 Ошибка API: {e}")
-                return "Ошибка при обработке запроса."
-        except Exception as e:
-            logger.error(f"🔴 Неизвестная ошибка: {e}", exc_info=True)
-            return "Извините, произошла ошибка при генерации ответа."
+                return LLMError("Ошибка при обработке запроса.")
+        logger.error(f"🔴 Неизвестная ошибка: {e}", exc_info=True)
+        return LLMError("Извините, произошла ошибка при генерации ответа.")
+
+    async def _post(self, payload: Dict) -> str:
+        started = time.monotonic()
+        try:
+            response = await self.client.post(self.base_url, headers=self.headers, json=payload)
+        except httpx.TransportError as e:
+            LLM_RESPONSES.inc(_transport_status(e))
+            raise
+        LLM_RESPONSES.inc(str(response.status_code))
+        response.raise_for_status()
+        data = response.json()
+        self._latencies.append(time.monotonic() - started)
+        return data["result"]["alternatives"][0]["message"]["text"].strip()
+
+    async def _open_stream(self, payload: Dict) -> Tuple[AsyncExitStack, AsyncIterator[str], Optional[str]]:
+        """Отправить потоковый запрос и дождаться первой части ответа (None — ответ пустой)"""
+        started = time.monotonic()
+        stack = AsyncExitStack()
+        try:
+            response = await stack.enter_async_context(
+                self.client.stream("POST", self.base_url, headers=self.headers, json=payload)
+            )
+            LLM_RESPONSES.inc(str(response.status_code))
+            response.raise_for_status()
+            lines = response.aiter_lines()
+            async for line in lines:
+                if line.strip():
+                    self._first_chunk_latencies.append(time.monotonic() - started)
+                    return stack, lines, _stream_text(line)
+            return stack, lines, None
+        except BaseException as e:
+            if isinstance(e, httpx.TransportError):
+                LLM_RESPONSES.inc(_transport_status(e))
+            await stack.aclose()
+            raise
+
+    @staticmethod
+    def _hedge_delay(latencies: Deque[float]) -> Optional[float]:
+        """Через сколько секунд отправлять дублирующий запрос (p95 задержки) или None"""
+        if not settings.llm_hedging or len(latencies) < settings.llm_hedge_min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _reserve_hedge(self) -> bool:
+        """Место в планировщике и токен квоты для дублирующего запроса, если они есть прямо сейчас"""
+        if not self.scheduler.try_acquire():
+            return False
+        if not self.rate_limiter.try_acquire():
+            self.scheduler.release()
+            return False
+        return True
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[T]], latencies: Deque[float],
+                      discard: Optional[Callable[[T], Awaitable]] = None) -> T:
+        """Выполнить attempt(); если результата нет дольше p95, запустить второй такой же и взять первый успешный.
+
+        Дублирующий запрос занимает отдельное место в планировщике и токен квоты;
+        если их нет, запрос не дублируется. discard освобождает результат
+        проигравшей попытки (например, закрывает открытый поток).
+        """
+        delay = self._hedge_delay(latencies)
+        if delay is None:
+            return await attempt()
+
+        tasks = [asyncio.create_task(attempt())]
+        winner = None
+        reserved = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._reserve_hedge():
+                reserved = True
+                self.hedged_requests += 1
+                tasks.append(asyncio.create_task(attempt()))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+                    task.add_done_callback(functools.partial(_discard_attempt, discard=discard))
+            if reserved:
+                self.scheduler.release()
+
+    def _record_failure(self, e: Exception, breaker: Optional[CircuitBreaker] = None):
+        """Итог запроса, завершившегося ошибкой: сбоем API считаются только 429/5xx и сетевые ошибки"""
+        breaker = breaker or self.breaker
+        if self._is_retryable(e):
+            breaker.record_failure()
+        else:
+            breaker.release()
+
+    async def make_request(self, messages: List[Dict], user_key: Hashable = None,
+                           model: Optional[str] = None, max_tokens: Optional[int] = None,
+                           breaker: Optional[CircuitBreaker] = None) -> str:
+        """
+        Выполнить запрос к Yandex API (по умолчанию к основной модели). При ошибке выбрасывает LLMError.
+        breaker — размыкатель для учета итога; по умолчанию общий для вопросов пользователей.
+        """
+        payload = self._build_payload(messages, model=model, max_tokens=max_tokens)
+        breaker = breaker or self.breaker
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self.scheduler.slot(user_key):
+                if not breaker.allow():
+                    outcome = "unavailable"
+                    raise LLMUnavailableError()
+                # Размыкатель учитывает один итог на запрос, а не каждый повтор или дубль
+                recorded = False
+                try:
+                    for attempt in range(settings.llm_max_retries + 1):
+                        await self.rate_limiter.acquire()
+                        attempt_started = time.monotonic()
+                        try:
+                            result = await self._hedged(lambda: self._post(payload), self._latencies)
+                        except Exception as e:
+                            if attempt < settings.llm_max_retries and self._is_retryable(e):
+                                delay = self._backoff_delay(attempt, e)
+                                logger.warning(f"⚠️ Повтор запроса к LLM через {delay:.1f} с: {e}")
+                                await asyncio.sleep(delay)
+                                continue
+                            recorded = True
+                            self._record_failure(e, breaker)
+                            raise self._to_llm_error(e) from e
+                        recorded = True
+                        breaker.record_success(time.monotonic() - attempt_started)
+                        outcome = "ok"
+                        return result
+                finally:
+                    if not recorded:
+                        breaker.release()
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                outcome = "cancelled"
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, "request", outcome)
+
+    async def stream_request(self, messages: List[Dict], user_key: Hashable = None) -> AsyncIterator[str]:
+        """
+        Потоковый запрос к Yandex API: отдает накопленный текст ответа по мере генерации.
+        Повтор и дублирование возможны только до получения первой части ответа. При ошибке выбрасывает LLMError.
+        """
+        payload = self._build_payload(messages, stream=True)
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self.scheduler.slot(user_key):
+                if not self.breaker.allow():
+                    outcome = "unavailable"
+                    raise LLMUnavailableError()
+                async with aclosing(self._stream_attempts(payload, started)) as attempts:
+                    async for text in attempts:
+                        yield text
+                outcome = "ok"
+        except BaseException as e:
+            # GeneratorExit — читатель перестал забирать ответ
+            if not isinstance(e, Exception):
+                outcome = "cancelled"
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, "stream", outcome)
+
+    async def _stream_attempts(self, payload: Dict, started: float) -> AsyncIterator[str]:
+        """Попытки потокового запроса с повторами до первой части ответа; итог записывается в размыкатель"""
+        recorded = False
+        try:
+            for attempt in range(settings.llm_max_retries + 1):
+                await self.rate_limiter.acquire()
+                attempt_started = time.monotonic()
+                try:
+                    stack, lines, text = await self._hedged(
+                        lambda: self._open_stream(payload), self._first_chunk_latencies, _close_stream
+                    )
+                except Exception as e:
+                    if attempt < settings.llm_max_retries and self._is_retryable(e):
+                        delay = self._backoff_delay(attempt, e)
+                        logger.warning(f"⚠️ Повтор потокового запроса к LLM через {delay:.1f} с: {e}")
+                        await asyncio.sleep(delay)
+                        continue
+                    recorded = True
+                    self._record_failure(e)
+                    raise self._to_llm_error(e) from e
+                # Для потока важна задержка до первой части ответа
+                recorded = True
+                self.breaker.record_success(time.monotonic() - attempt_started)
+                LLM_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - started)
+
+                async with stack:
+                    try:
+                        if text is not None:
+                            yield text
+                        # Каждая строка — JSON с полным текстом, сгенерированным на данный момент
+                        async for line in lines:
+                            if line.strip():
+                                yield _stream_text(line)
+                    except Exception as e:
+                        if isinstance(e, httpx.TransportError):
+                            LLM_RESPONSES.inc(_transport_status(e))
+                        raise self._to_llm_error(e) from e
+                return
+        finally:
+            if not recorded:
+                self.breaker.release()
 
 class YandexLLM:
     def __init__(self, prompts_dir: str = "prompts"):
         self.prompt_manager = PromptManager(prompts_dir)
         self.api_client = YandexAPIClient()
+        tokenize = self.api_client.tokenize if settings.context_token_estimator == "yandex" else None
+        self.context_builder = ContextBuilder(TokenCounter(tokenize))
         logger.info("✅ YandexLLM инициализирован")
     
     async def close(self):
         """Закрыть ресурсы"""
         await self.api_client.close()
+
+    async def warm_up(self):
+        """Прогреть соединения с API до первого запроса пользователя"""
+        await self.api_client.warm_up()
     
     def select_prompt(self, prompt_name: str) -> str:
         """Выбрать промпт (совместимость со старым кодом)"""
         return self.prompt_manager.get_prompt(prompt_name)
+
+    def get_prompt(self, prompt_name: str) -> Prompt:
+        """Промпт с версией и готовым системным сообщением"""
+        return self.prompt_manager.get(prompt_name)
     
-    def determine_intent(self, user_message: str) -> str:
+    def determine_intent(self, user_message: str, previous_intent: Optional[str] = None) -> str:
         """Определить интент (совместимость со старым кодом)"""
-        return self.prompt_manager.determine_intent(user_message)
+        return self.prompt_manager.determine_intent(user_message, previous_intent)
     
-    async def chat(self, user_message: str, history: List[Dict[str, str]], prompt_type: str = "general") -> str:
-        """Основной метод для общения с ИИ"""
-        sys_prompt = self.select_prompt(prompt_type)
-        messages = [{"role": "system", "text": sys_prompt}]
-        
-        for msg in history:
-            if msg["role"] in ("user", "assistant"):
-                messages.append({
-                    "role": msg["role"],
-                    "text": msg["content"]
-                })
-        
-        messages.append({"role": "user", "text": user_message})
-        
-        return await self.api_client.make_request(messages)
\ No newline at end of file
+    async def _build_messages(self, user_message: str, history: List[Dict[str, str]], prompt_type: str) -> List[Dict]:
+        """Системный промпт с фрагментами документов, новейшая часть истории в пределах бюджета токенов и вопрос"""
+        prompt = self.get_prompt(prompt_type)
+        extra_context = []
+        if settings.retrieval_enabled:
+            await document_index.refresh()
+            passages = document_index.search(user_message)
+            if passages:
+                extra_context.append(
+                    f"Сведения из документов проекта (опирайся на них при ответе):\n{format_passages(passages)}"
+                )
+        return await self.context_builder.build(prompt.message, history, user_message, extra_context)
+
+    async def chat(self, user_message: str, history: List[Dict[str, str]], prompt_type: str = "general",
+                   user_key: Hashable = None) -> str:
+        """Основной метод для общения с ИИ. user_key — ключ честной очереди (например, chat_id)"""
+        messages = await self._build_messages(user_message, history, prompt_type)
+        return await self.api_client.make_request(messages, user_key)
+
+    async def chat_stream(self, user_message: str, history: List[Dict[str, str]],
+                          prompt_type: str = "general", user_key: Hashable = None) -> AsyncIterator[str]:
+        """Потоковый вариант chat(): отдает накопленный текст ответа по мере генерации"""
+        messages = await self._build_messages(user_message, history, prompt_type)
+        async for text in self.api_client.stream_request(messages, user_key):
+            yield text
\ No newline at end of file
@@ -0,0 +1,119 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Hashable, Optional
+
+class TokenBucket:
+    """Ограничение частоты запросов: не более `rate` в секунду с запасом `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()  # Ожидающие получают токены по очереди
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Взять токен без ожидания; False, если токенов нет или их уже ждут"""
+        if self.rate <= 0:
+            return True
+        if self._lock.locked():
+            return False
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+class FairScheduler:
+    """Ограничение числа одновременных запросов с честной очередью.
+
+    Ожидающие запросы сгруппированы по ключу (например, chat_id) и
+    обслуживаются по кругу: пользователь, отправивший много сообщений,
+    не может занять все места впереди остальных.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._active = 0
+        self._waiting = 0
+        self._queues: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        """Число запросов, ожидающих свободного места"""
+        return self._waiting
+
+    def try_acquire(self) -> bool:
+        """Занять место без ожидания; False, если свободных мест нет или есть очередь"""
+        if self._active < self.max_concurrency and not self._queues:
+            self._active += 1
+            return True
+        return False
+
+    async def acquire(self, key: Hashable = None):
+        if self.try_acquire():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        self._waiting += 1
+        try:
+            # Место передается напрямую из release(), счетчик _active не меняется
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место успели выдать до отмены — возвращаем его
+                self.release()
+            else:
+                queue = self._queues.get(key)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    self._waiting -= 1
+                    if not queue:
+                        del self._queues[key]
+            raise
+
+    def release(self):
+        while self._queues:
+            key, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            # Следующий запрос этого ключа встает в конец круга
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable = None):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,226 @@
+import time
+import functools
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from services.http_server import Request, Response
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Метрика с конкретными значениями меток; повторный вызов — поиск в словаре"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Значение метрики для нового набора меток"""
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Строки значений в текстовом формате Prometheus"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, *values: str, amount: float = 1.0):
+        self.labels(*values).inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Последняя ячейка — значения больше верхней границы (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (обычно длительностей в секундах)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float, *values: str):
+        self.labels(*values).observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+# Значение метрики без меток или словарь «значения меток -> значение»
+CallbackResult = Union[float, Dict[Tuple[str, ...], float]]
+
+class CallbackMetric(_Metric):
+    """Метрика, значения которой читаются при выгрузке из уже существующих счетчиков сервисов"""
+
+    def __init__(self, name: str, help_text: str, kind: str, func: Callable[[], CallbackResult],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.func = func
+
+    def _new_child(self):
+        raise TypeError(f"{self.name}: значения вычисляются функцией, labels() не поддерживается")
+
+    def _samples(self) -> List[str]:
+        try:
+            result = self.func()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось получить метрику {self.name}: {e}")
+            return []
+        if not isinstance(result, dict):
+            result = {(): result}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+            for values, value in result.items()
+        ]
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выгрузка в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name: str, help_text: str, kind: str, func: Callable[[], CallbackResult],
+                 labelnames: Sequence[str] = ()) -> CallbackMetric:
+        """Зарегистрировать (или заменить) метрику, значения которой вычисляет func"""
+        self._metrics.pop(name, None)
+        return self._register(CallbackMetric(name, help_text, kind, func, labelnames))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+# Глобальный реестр метрик
+metrics = MetricsRegistry()
+
+UPDATES = metrics.counter("bot_updates_total", "Обработанные обновления по обработчикам", ["handler", "status"])
+UPDATE_SECONDS = metrics.histogram("bot_update_duration_seconds", "Время обработки обновления", ["handler"])
+LLM_RESPONSES = metrics.counter("bot_llm_responses_total", "Ответы Yandex API по кодам статуса", ["status"])
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "bot_llm_request_duration_seconds", "Время запроса к LLM с учетом очереди и повторов; у потока — до конца ответа",
+    ["mode", "outcome"], buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0),
+)
+LLM_FIRST_CHUNK_SECONDS = metrics.histogram(
+    "bot_llm_first_chunk_seconds", "Время потокового запроса до первой части ответа с учетом очереди и повторов",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0),
+)
+HISTORY_SECONDS = metrics.histogram("bot_history_duration_seconds", "Чтение и запись истории чатов", ["operation"])
+DOCUMENT_SEND_SECONDS = metrics.histogram(
+    "bot_document_send_duration_seconds", "Отправка документа пользователю", ["source"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+def track_handler(name: str, callback: Callable) -> Callable:
+    """Обернуть обработчик PTB: счетчик вызовов по исходу и гистограмма длительности"""
+    duration = UPDATE_SECONDS.labels(name)
+    succeeded = UPDATES.labels(name, "ok")
+    failed = UPDATES.labels(name, "error")
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+        except Exception:
+            failed.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - started)
+        succeeded.inc()
+        return result
+
+    return wrapper
+
+async def handle_metrics(request: Request) -> Response:
+    """GET /metrics в формате Prometheus"""
+    return Response(200, metrics.render().encode("utf-8"), PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,112 @@
+import os
+import time
+import hashlib
+from typing import Dict, NamedTuple, Optional, Tuple
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+FALLBACK_PROMPT_NAME = "general"
+# Используется, только если в папке нет даже general.txt
+DEFAULT_PROMPT_TEXT = "Ты — ИИ-помощник проекта «Усадьба». Отвечай кратко, по делу и вежливо."
+
+class Prompt(NamedTuple):
+    name: str
+    text: str
+    version: str  # Хэш содержимого: меняется только при изменении текста
+
+    @property
+    def message(self) -> Dict[str, str]:
+        """Системное сообщение в формате Yandex; каждый раз новый обычный dict, общий только текст"""
+        return {"role": "system", "text": self.text}
+
+def make_prompt(name: str, text: str) -> Prompt:
+    version = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+    return Prompt(name, text, version)
+
+class PromptRegistry:
+    """Системные промпты из папки prompts/.
+
+    Все промпты читаются при создании; затем не чаще, чем раз в
+    `prompts_check_interval` секунд, папка проверяется по mtime, и измененные
+    файлы перечитываются. Новый набор промптов подменяется целиком.
+    """
+
+    def __init__(self, prompts_dir: str = "prompts", check_interval: Optional[float] = None):
+        self.prompts_dir = prompts_dir
+        self.check_interval = settings.prompts_check_interval if check_interval is None else check_interval
+        self._prompts: Dict[str, Prompt] = {}
+        self._signature: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._default = make_prompt(FALLBACK_PROMPT_NAME, DEFAULT_PROMPT_TEXT)
+        self._missing_reported = set()
+        self.reload()
+
+    def _scan(self) -> Optional[Dict[str, Tuple[str, int, int]]]:
+        """Имя промпта -> (путь, размер, mtime); None, если папку не удалось прочитать"""
+        files = {}
+        try:
+            with os.scandir(self.prompts_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".txt") and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name[:-4]] = (entry.path, stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            logger.error(f"❌ Не удалось прочитать папку промптов {self.prompts_dir}: {e}")
+            return None
+        return files
+
+    def reload(self, force: bool = True) -> bool:
+        """Перечитать измененные промпты. Возвращает True, если набор промптов изменился"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        files = self._scan()
+        if files is None:
+            # Продолжаем работать с уже загруженными промптами
+            return False
+        signature = tuple(sorted((name, size, mtime) for name, (_, size, mtime) in files.items()))
+        if signature == self._signature:
+            return False
+
+        prompts = {}
+        for name, (path, _, _) in files.items():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read().strip()
+            except OSError as e:
+                logger.error(f"❌ Не удалось прочитать промпт {path}: {e}")
+                # Оставляем прежнюю версию, если она была
+                if name in self._prompts:
+                    prompts[name] = self._prompts[name]
+                continue
+            previous = self._prompts.get(name)
+            prompts[name] = previous if previous is not None and previous.text == text else make_prompt(name, text)
+
+        if FALLBACK_PROMPT_NAME not in prompts:
+            logger.warning(f"⚠️ Нет промпта {FALLBACK_PROMPT_NAME}.txt в {self.prompts_dir}, используется встроенный")
+
+        changed = [name for name, prompt in prompts.items() if self._prompts.get(name) != prompt]
+        self._prompts = prompts
+        self._signature = signature
+        if changed:
+            logger.info(f"📝 Промпты загружены: {', '.join(f'{n}@{prompts[n].version}' for n in sorted(changed))}")
+        return True
+
+    def get(self, name: str) -> Prompt:
+        """Промпт по имени; при его отсутствии — general, а без него — встроенный"""
+        self.reload(force=False)
+        prompt = self._prompts.get(name)
+        if prompt is None:
+            prompt = self._prompts.get(FALLBACK_PROMPT_NAME, self._default)
+            if name not in self._missing_reported:
+                self._missing_reported.add(name)
+                logger.warning(f"⚠️ Файл промпта не найден: {name}.txt, используется {prompt.name}")
+        return prompt
+
+    @property
+    def names(self):
+        return sorted(self._prompts)
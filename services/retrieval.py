@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import math
+import heapq
+import asyncio
+import zipfile
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+from config import settings
+from services.documents import DocumentCatalog, DocumentInfo, catalog, knowledge_catalog
+from utils.helpers import RU_STOP_WORDS, stem_ru, tokenize
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf — опциональная зависимость, без нее PDF не индексируются
+    PdfReader = None
+
+# Параметры BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+INDEX_VERSION = 2
+
+def _xml_texts(data: bytes, tag: str) -> List[str]:
+    """Тексты всех элементов с локальным именем tag (без учета пространства имен)"""
+    suffix = "}" + tag
+    return [el.text or "" for el in ElementTree.fromstring(data).iter() if el.tag.endswith(suffix)]
+
+def _extract_docx(path: str) -> str:
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter():
+        if paragraph.tag.endswith("}p"):
+            text = "".join(el.text or "" for el in paragraph.iter() if el.tag.endswith("}t"))
+            if text.strip():
+                paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+def _extract_pptx(path: str) -> str:
+    with zipfile.ZipFile(path) as archive:
+        slides = [n for n in archive.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)]
+        slides.sort(key=lambda n: int(re.search(r"\d+", n.rsplit("/", 1)[1]).group()))
+        # Каждый слайд — отдельный абзац
+        return "\n\n".join(" ".join(_xml_texts(archive.read(name), "t")) for name in slides)
+
+def _extract_xlsx(path: str) -> str:
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        texts = _xml_texts(archive.read("xl/sharedStrings.xml"), "t") if "xl/sharedStrings.xml" in names else []
+        # Строки, записанные прямо в ячейках листов
+        for name in names:
+            if name.startswith("xl/worksheets/") and name.endswith(".xml"):
+                texts.extend(_xml_texts(archive.read(name), "t"))
+    return "\n".join(text for text in texts if text.strip())
+
+def _extract_pdf(path: str) -> str:
+    if PdfReader is None:
+        logger.warning(f"⚠️ pypdf не установлен, документ не проиндексирован: {path}")
+        return ""
+    return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+def _extract_txt(path: str) -> str:
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("cp1251", errors="replace")
+
+EXTRACTORS = {
+    ".txt": _extract_txt,
+    ".docx": _extract_docx,
+    ".pptx": _extract_pptx,
+    ".xlsx": _extract_xlsx,
+    ".pdf": _extract_pdf,
+}
+
+def extract_text(doc: DocumentInfo) -> str:
+    """Текст документа или пустая строка для неподдерживаемых типов (например, картинок)"""
+    extractor = EXTRACTORS.get(doc.ext)
+    if extractor is None:
+        return ""
+    try:
+        return extractor(doc.path)
+    except Exception as e:
+        logger.error(f"❌ Не удалось извлечь текст из {doc.filename}: {e}")
+        return ""
+
+def split_chunks(text: str, max_chars: int) -> List[str]:
+    """Разбить текст на фрагменты до max_chars символов по границам абзацев и предложений"""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            if paragraph:
+                pieces.append(paragraph)
+            continue
+        # Длинный абзац режем по предложениям, а слишком длинные предложения — по длине
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def index_terms(text: str) -> List[str]:
+    return [stem_ru(word) for word in tokenize(text) if word not in RU_STOP_WORDS]
+
+class Passage(NamedTuple):
+    document: str  # Имя документа без расширения
+    text: str
+    score: float
+
+class _Snapshot(NamedTuple):
+    chunks: List[Tuple[str, str]]  # (документ, текст)
+    postings: Dict[str, List[Tuple[int, int]]]  # основа -> [(фрагмент, частота)]
+    lengths: List[int]
+    avg_length: float
+
+class DocumentIndex:
+    """BM25-индекс фрагментов документов и справочных текстов (knowledge_dir).
+
+    Фрагменты хранятся вместе с отпечатком (размер, mtime) своего документа,
+    поэтому при изменениях в папке заново разбираются только измененные файлы.
+    Индекс сохраняется на диск и при запуске загружается без разбора документов.
+    """
+
+    def __init__(self, index_file: Optional[str] = None, catalogs: Optional[Sequence[DocumentCatalog]] = None):
+        self.index_file = index_file or settings.retrieval_index_file
+        self.catalogs = tuple(catalogs or (catalog, knowledge_catalog))
+        self._built_version: Optional[Tuple[int, ...]] = None
+        # Путь к файлу -> {"fingerprint": [size, mtime_ns], "chunks": [...]}
+        self._documents: Dict[str, dict] = {}
+        # Индекс пересобирается в потоке и подменяется одной ссылкой
+        self._snapshot = _Snapshot([], {}, [], 0.0)
+        self._lock = asyncio.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self._documents = data["documents"]
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить индекс документов: {e}")
+
+    def _save(self):
+        tmp_path = f"{self.index_file}.tmp"
+        os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "documents": self._documents}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_file)
+
+    def _rebuild(self, documents: List[DocumentInfo]):
+        """Обновить фрагменты измененных документов и пересобрать постинги (выполняется в потоке)"""
+        if not self._documents:
+            self._load()
+
+        changed = False
+        current = {}
+        for doc in documents:
+            entry = self._documents.get(doc.path)
+            # PDF без текста перечитываем, если с прошлого раза появился pypdf
+            stale = entry is None or tuple(entry["fingerprint"]) != doc.fingerprint
+            if stale or (not entry["chunks"] and doc.ext == ".pdf" and PdfReader is not None):
+                text = extract_text(doc)
+                entry = {
+                    "name": doc.name,
+                    "fingerprint": list(doc.fingerprint),
+                    "chunks": split_chunks(text, settings.retrieval_chunk_chars),
+                }
+                changed = True
+            current[doc.path] = entry
+        changed = changed or current.keys() != self._documents.keys()
+        self._documents = current
+
+        chunks = [(entry["name"], chunk) for entry in current.values() for chunk in entry["chunks"]]
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for chunk_id, (name, text) in enumerate(chunks):
+            # Название документа тоже участвует в поиске
+            terms = Counter(index_terms(f"{name} {text}"))
+            lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                postings.setdefault(term, []).append((chunk_id, frequency))
+
+        self._snapshot = _Snapshot(chunks, postings, lengths, sum(lengths) / len(lengths) if lengths else 0.0)
+
+        if changed:
+            self._save()
+        logger.info(f"📚 Индекс документов: {len(current)} файлов, {len(chunks)} фрагментов")
+
+    def _version(self) -> Tuple[int, ...]:
+        return tuple(documents.version for documents in self.catalogs)
+
+    async def refresh(self, force: bool = False):
+        """Обновить индекс, если изменилась папка документов или справочных текстов"""
+        for documents in self.catalogs:
+            documents.refresh(force=force)
+        if not force and self._built_version == self._version():
+            return
+        async with self._lock:
+            version = self._version()
+            if not force and self._built_version == version:
+                return
+            # Разбор PDF и Office-файлов не должен блокировать обработку сообщений
+            await asyncio.to_thread(self._rebuild, [doc for documents in self.catalogs for doc in documents.documents])
+            self._built_version = version
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[Passage]:
+        """Наиболее релевантные запросу фрагменты по BM25"""
+        top_k = settings.retrieval_top_k if top_k is None else top_k
+        snapshot = self._snapshot
+        if not snapshot.chunks or top_k <= 0:
+            return []
+
+        total = len(snapshot.chunks)
+        scores: Dict[int, float] = {}
+        for term in set(index_terms(query)):
+            postings = snapshot.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * snapshot.lengths[chunk_id] / snapshot.avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [
+            Passage(snapshot.chunks[chunk_id][0], snapshot.chunks[chunk_id][1], score)
+            for chunk_id, score in best
+            if score >= settings.retrieval_min_score
+        ]
+
+def format_passages(passages: List[Passage]) -> str:
+    """Фрагменты документов для системного промпта"""
+    return "\n\n".join(f"[{p.document}]\n{p.text}" for p in passages)
+
+# Глобальный индекс документов
+document_index = DocumentIndex()
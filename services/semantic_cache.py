@@ -0,0 +1,203 @@
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+import httpx
+from config import settings
+from services.metrics import metrics
+from utils.helpers import RU_STOP_WORDS, stem_ru, tokenize
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+try:
+    import numpy as np
+except ImportError:  # numpy — опциональная зависимость
+    np = None
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+def question_numbers(text: str) -> Tuple[str, ...]:
+    """Числа вопроса: у вопросов о 10 и 20 сотках почти одинаковые эмбеддинги, но разные ответы"""
+    return tuple(sorted(number.replace(",", ".") for number in _NUMBER_RE.findall(text)))
+
+class HashingEmbedder:
+    """Локальный эмбеддер без сети: хэширование основ слов и их символьных триграмм"""
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or settings.semantic_cache_dim
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for word in tokenize(text):
+            if word in RU_STOP_WORDS:
+                continue
+            stem = stem_ru(word)
+            features.append(stem)
+            padded = f"<{stem}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    async def embed(self, text: str) -> Optional["np.ndarray"]:
+        features = self._features(text)
+        if not features:
+            return None
+
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+        # Младший бит хэша задает знак, чтобы коллизии в среднем гасили друг друга
+        signs = np.where(hashes & 1, 1.0, -1.0).astype(np.float32)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        np.add.at(vector, (hashes >> 1) % self.dim, signs)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+class YandexEmbedder:
+    """Эмбеддинги Yandex Foundation Models (text-search-query)"""
+
+    url = "https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding"
+
+    def __init__(self):
+        self.model_uri = f"emb://{settings.ya_folder_id}/text-search-query/latest"
+        self.headers = {
+            "Authorization": f"Api-Key {settings.ya_api_key}",
+            "Content-Type": "application/json",
+        }
+        self.client = httpx.AsyncClient(timeout=5.0)
+
+    async def embed(self, text: str) -> Optional["np.ndarray"]:
+        try:
+            response = await self.client.post(
+                self.url, headers=self.headers, json={"modelUri": self.model_uri, "text": text}
+            )
+            response.raise_for_status()
+            vector = np.asarray(response.json()["embedding"], dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось получить эмбеддинг: {e}")
+            return None
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def close(self):
+        await self.client.aclose()
+
+class _IntentIndex:
+    """Векторы вопросов одного интента в непрерывной матрице, числа вопросов и соответствующие ответы"""
+
+    def __init__(self, dim: int, max_entries: int):
+        self.max_entries = max_entries
+        self.vectors = np.zeros((min(256, max_entries), dim), dtype=np.float32)
+        self.numbers: List[Tuple[str, ...]] = []
+        self.answers: List[str] = []
+        self.size = 0
+        self._next = 0  # Позиция для перезаписи после заполнения
+
+    def search(self, vector: "np.ndarray", numbers: Tuple[str, ...], threshold: float):
+        """Самый близкий вопрос с теми же числами и близостью не ниже threshold: (близость, позиция)"""
+        if not self.size:
+            return -1.0, -1
+        # Векторы нормированы, поэтому косинусная близость — одно матрично-векторное умножение
+        scores = self.vectors[:self.size] @ vector
+        candidates = np.flatnonzero(scores >= threshold)
+        for position in candidates[np.argsort(-scores[candidates])]:
+            if self.numbers[position] == numbers:
+                return float(scores[position]), int(position)
+        return -1.0, -1
+
+    def add(self, vector: "np.ndarray", numbers: Tuple[str, ...], answer: str):
+        if self.size < self.max_entries:
+            if self.size == len(self.vectors):
+                grown = np.zeros((min(len(self.vectors) * 2, self.max_entries), self.vectors.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.vectors
+                self.vectors = grown
+            position = self.size
+            self.size += 1
+            self.numbers.append(numbers)
+            self.answers.append(answer)
+        else:
+            # Индекс заполнен: перезаписываем самые старые записи по кругу
+            position = self._next
+            self._next = (self._next + 1) % self.max_entries
+            self.numbers[position] = numbers
+            self.answers[position] = answer
+        self.vectors[position] = vector
+
+class SemanticCache:
+    """Кэш ответов по смысловой близости вопросов.
+
+    Для каждого интента хранится отдельная матрица нормированных эмбеддингов;
+    ответ возвращается, если косинусная близость к сохраненному вопросу не
+    ниже `semantic_cache_threshold` и числа в вопросах совпадают.
+    """
+
+    def __init__(self, embedder=None):
+        self.enabled = settings.semantic_cache_enabled and np is not None
+        if settings.semantic_cache_enabled and np is None:
+            logger.warning("⚠️ numpy не установлен, семантический кэш отключен")
+
+        self.threshold = settings.semantic_cache_threshold
+        self.max_entries = settings.semantic_cache_max_entries
+        self.embedder = embedder
+        if self.enabled and self.embedder is None:
+            self.embedder = YandexEmbedder() if settings.semantic_cache_embedder == "yandex" else HashingEmbedder()
+        self._indexes: Dict[str, _IntentIndex] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    async def embed(self, text: str) -> Optional["np.ndarray"]:
+        """Получить нормированный эмбеддинг вопроса или None"""
+        if not self.enabled:
+            return None
+        return await self.embedder.embed(text)
+
+    def lookup(self, intent: str, question: str, vector: Optional["np.ndarray"]) -> Optional[str]:
+        """Найти ответ на близкий по смыслу вопрос с теми же числами"""
+        index = self._indexes.get(intent)
+        if vector is None or index is None:
+            self.misses += 1
+            return None
+
+        score, position = index.search(vector, question_numbers(question), self.threshold)
+        if position < 0:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.info(f"✅ Ответ найден в семантическом кэше ({intent}, близость {score:.3f})")
+        return index.answers[position]
+
+    def add(self, intent: str, question: str, vector: Optional["np.ndarray"], answer: str):
+        """Сохранить ответ на вопрос"""
+        if vector is None or not self.enabled:
+            return
+        index = self._indexes.get(intent)
+        if index is None:
+            index = self._indexes[intent] = _IntentIndex(len(vector), self.max_entries)
+
+        # Почти совпадающий вопрос с теми же числами уже есть — обновляем ответ вместо дубликата
+        numbers = question_numbers(question)
+        _, position = index.search(vector, numbers, 0.99)
+        if position >= 0:
+            index.answers[position] = answer
+            return
+        index.add(vector, numbers, answer)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": sum(index.size for index in self._indexes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def close(self):
+        if hasattr(self.embedder, "close"):
+            await self.embedder.close()
+
+# Глобальный экземпляр семантического кэша
+semantic_cache = SemanticCache()
+
+metrics.callback("bot_semantic_cache_operations_total", "Обращения к семантическому кэшу ответов", "counter",
+                 lambda: {("hit",): semantic_cache.hits, ("miss",): semantic_cache.misses}, ["operation"])
+metrics.callback("bot_semantic_cache_entries", "Вопросы в семантическом кэше", "gauge",
+                 lambda: semantic_cache.stats()["entries"])
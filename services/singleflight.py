@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from services.metrics import metrics
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов.
+
+    Пока запрос с данным ключом выполняется, остальные вызовы с тем же
+    ключом не запускают его повторно, а ждут общий результат.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.calls = 0      # Запросов, выполненных на самом деле
+        self.coalesced = 0  # Запросов, получивших чужой результат
+        self.retried = 0    # Ожидавших, которые повторили запрос после отмены выполнявшего
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Выполнить func или дождаться уже идущего вызова. Возвращает (результат, получен ли он от другого вызова)"""
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                # shield: отмена ожидающего не должна отменять общий результат
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                # Отменили самого ожидающего — выходим; отменили выполнявший запрос вызов — повторяем сами
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                self.retried += 1
+                logger.info(f"🔁 Общий запрос {key[:16]} отменен, выполняем заново")
+
+        self.calls += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем исключение полученным, даже если никто не ждал
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "inflight": len(self._inflight),
+        }
+
+# Объединение одинаковых запросов к LLM
+llm_singleflight = SingleFlight()
+
+metrics.callback(
+    "bot_llm_singleflight_total", "Вопросы к LLM: выполненные сами, получившие общий ответ и повторенные после отмены общего",
+    "counter",
+    lambda: {
+        ("leader",): llm_singleflight.calls,
+        ("coalesced",): llm_singleflight.coalesced,
+        ("retried",): llm_singleflight.retried,
+    },
+    ["result"],
+)
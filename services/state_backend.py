@@ -0,0 +1,235 @@
+import time
+import uuid
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncIterator, Dict, List, Optional, Tuple
+from config import settings
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis — опциональная зависимость, нужна только для общего состояния
+    aioredis = None
+
+class StateBackend(ABC):
+    """Хранилище состояния бота: строки с TTL, списки записей и блокировки чатов.
+
+    `shared` — видно ли состояние другим процессам. Если нет, кэш и история
+    остаются в локальных файлах, а бэкенд дает только блокировки внутри процесса.
+    """
+
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Значение ключа или None"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Записать значение; через ttl секунд оно исчезнет"""
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        """Удалить ключи (и значения, и списки)"""
+
+    @abstractmethod
+    async def append(self, key: str, values: List[str], max_len: Optional[int] = None):
+        """Дописать значения в конец списка, оставив не более max_len последних"""
+
+    @abstractmethod
+    async def tail(self, key: str, count: int) -> List[str]:
+        """Последние count значений списка"""
+
+    @abstractmethod
+    def lock(self, key: str, ttl: Optional[float] = None, timeout: Optional[float] = None) -> AsyncContextManager[bool]:
+        """
+        Блокировка с автоматическим снятием через ttl секунд (на случай падения
+        процесса); пока она взята, ttl продлевается. Ждет не дольше timeout
+        секунд; возвращает, удалось ли ее взять.
+        """
+
+    async def close(self):
+        pass
+
+class MemoryStateBackend(StateBackend):
+    """Состояние в памяти процесса. Та же семантика, что у Redis: подходит для одного процесса и тестов"""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lists: Dict[str, List[str]] = {}
+        # Ключ -> (блокировка, число держателей и ожидающих)
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    def _alive(self, key: str) -> Optional[str]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._alive(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+
+    async def append(self, key: str, values: List[str], max_len: Optional[int] = None):
+        items = self._lists.setdefault(key, [])
+        items.extend(values)
+        if max_len and len(items) > max_len:
+            del items[:len(items) - max_len]
+
+    async def tail(self, key: str, count: int) -> List[str]:
+        return list(self._lists.get(key, ())[-count:]) if count > 0 else []
+
+    @asynccontextmanager
+    async def lock(self, key: str, ttl: Optional[float] = None, timeout: Optional[float] = None) -> AsyncIterator[bool]:
+        """Блокировка внутри процесса: asyncio.Lock на ключ, ожидающие будятся по очереди. ttl не нужен"""
+        timeout = settings.chat_lock_wait if timeout is None else timeout
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Не дождались блокировки {key} за {timeout:.0f} с")
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                lock.release()
+        finally:
+            lock, users = self._locks[key]
+            if users > 1:
+                self._locks[key] = (lock, users - 1)
+            else:
+                del self._locks[key]
+
+class RedisStateBackend(StateBackend):
+    """Общее состояние в Redis: несколько процессов и хостов обслуживают одного бота"""
+
+    shared = True
+
+    # Снять блокировку, только если она все еще наша (не истекла и не взята другим)
+    _UNLOCK_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+
+    # Продлить блокировку, только если она все еще наша
+    _RENEW_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("pexpire", KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    def __init__(self, client=None, url: Optional[str] = None, prefix: Optional[str] = None):
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("Для STATE_BACKEND=redis установите пакет redis")
+            client = aioredis.from_url(url or settings.redis_url, decode_responses=True)
+        self.client = client
+        self.prefix = settings.state_key_prefix if prefix is None else prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(self._key(key))
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self.client.set(self._key(key), value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*(self._key(key) for key in keys))
+
+    async def append(self, key: str, values: List[str], max_len: Optional[int] = None):
+        if not values:
+            return
+        # Дозапись и обрезка одной транзакцией, за один сетевой запрос
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(self._key(key), *values)
+            if max_len:
+                pipe.ltrim(self._key(key), -max_len, -1)
+            await pipe.execute()
+
+    async def tail(self, key: str, count: int) -> List[str]:
+        if count <= 0:
+            return []
+        return await self.client.lrange(self._key(key), -count, -1)
+
+    async def _try_lock(self, key: str, token: str, ttl: float) -> bool:
+        return bool(await self.client.set(self._key(f"lock:{key}"), token, nx=True, px=int(ttl * 1000)))
+
+    async def _unlock(self, key: str, token: str):
+        await self.client.eval(self._UNLOCK_SCRIPT, 1, self._key(f"lock:{key}"), token)
+
+    async def _renew(self, key: str, token: str, ttl: float) -> bool:
+        return bool(await self.client.eval(self._RENEW_SCRIPT, 1, self._key(f"lock:{key}"), token, int(ttl * 1000)))
+
+    async def _keep_alive(self, key: str, token: str, ttl: float):
+        """Продлевать блокировку, пока держатель работает: запрос к LLM может идти дольше ttl"""
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await self._renew(key, token, ttl):
+                    logger.warning(f"⚠️ Блокировка {key} потеряна до окончания обработки")
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось продлить блокировку {key}: {e}")
+
+    @asynccontextmanager
+    async def lock(self, key: str, ttl: Optional[float] = None, timeout: Optional[float] = None) -> AsyncIterator[bool]:
+        """SET NX с опросом: Redis не будит ожидающих, поэтому ждем с нарастающей паузой"""
+        ttl = settings.chat_lock_ttl if ttl is None else ttl
+        timeout = settings.chat_lock_wait if timeout is None else timeout
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        acquired = await self._try_lock(key, token, ttl)
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+            acquired = await self._try_lock(key, token, ttl)
+        if not acquired:
+            logger.warning(f"⚠️ Не дождались блокировки {key} за {timeout:.0f} с")
+            yield False
+            return
+
+        keep_alive = asyncio.create_task(self._keep_alive(key, token, ttl))
+        try:
+            yield True
+        finally:
+            keep_alive.cancel()
+            await self._unlock(key, token)
+
+    async def close(self):
+        await self.client.aclose()
+
+def create_state_backend(name: Optional[str] = None) -> StateBackend:
+    """Бэкенд состояния по настройке state_backend: local или redis"""
+    name = name or settings.state_backend
+    if name == "redis":
+        return RedisStateBackend()
+    return MemoryStateBackend()
+
+# Глобальный бэкенд состояния
+state_backend = create_state_backend()
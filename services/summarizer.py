@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, List, Optional
+from config import settings
+from services.history import history_writer
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+SUMMARY_INSTRUCTION = (
+    "Ты ведешь заметки о диалоге консультанта проекта «Усадьба» с клиентом. "
+    "Обнови краткое содержание разговора: сохрани, кто клиент и что его интересует, "
+    "названные цифры (бюджет, площадь, сроки), заданные вопросы и данные ответы, "
+    "договоренности. Пиши кратко, в третьем лице, не более 10 предложений."
+)
+
+def split_summary(history: List[Dict[str, str]]):
+    """Разделить историю на сводку (или None) и пары вопрос-ответ"""
+    summary = None
+    turns = []
+    question = None
+    for msg in history:
+        role = msg.get("role")
+        if role == "summary":
+            summary = msg
+        elif role == "user":
+            question = msg
+        elif role == "assistant" and question is not None:
+            turns.append((question, msg))
+            question = None
+    return summary, turns
+
+class ConversationSummarizer:
+    """Фоновое сжатие длинной истории чата.
+
+    Когда в истории набирается больше `summary_trigger_pairs` пар, самые
+    старые из них вместе с прежней сводкой сворачиваются дешевой моделью в
+    новую сводку; в истории остаются последние `summary_keep_pairs` пар.
+    Сводка дописывается в файл истории и заменяет свернутые сообщения в памяти.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def maybe_schedule(self, chat_id: int, chat_data: dict, api_client):
+        """Запустить сжатие истории чата, если она выросла и сжатие еще не идет"""
+        if not settings.summary_enabled:
+            return
+        task = self._tasks.get(chat_id)
+        if task is not None and not task.done():
+            return
+
+        summary, turns = split_summary(chat_data.get("history", []))
+        if len(turns) <= settings.summary_trigger_pairs:
+            return
+        folded = turns[:len(turns) - settings.summary_keep_pairs]
+        self._tasks[chat_id] = asyncio.create_task(
+            self._summarize(chat_id, chat_data, api_client, summary, folded)
+        )
+
+    async def _summarize(self, chat_id: int, chat_data: dict, api_client, summary: Optional[dict], folded: list):
+        dialog = []
+        if summary is not None:
+            dialog.append(f"Краткое содержание ранее: {summary['content']}")
+        for question, answer in folded:
+            dialog.append(f"Клиент: {question['content']}\nКонсультант: {answer['content']}")
+        messages = [
+            {"role": "system", "text": SUMMARY_INSTRUCTION},
+            {"role": "user", "text": "\n\n".join(dialog)},
+        ]
+
+        try:
+            text = await api_client.make_request(
+                messages, user_key="summary", model=settings.summary_model, max_tokens=settings.summary_max_tokens,
+                breaker=api_client.background_breaker,
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сжать историю чата {chat_id}: {e}")
+            return
+        finally:
+            self._tasks.pop(chat_id, None)
+
+        history = chat_data.get("history")
+        folded_ids = {id(msg) for pair in folded for msg in pair}
+        if history is None or not folded_ids & {id(msg) for msg in history}:
+            # Контекст сбросили, пока готовилась сводка
+            return
+
+        # Свернутые пары могли частично уйти из памяти при обрезке, но оставшиеся — новее их
+        remaining = [msg for msg in history if id(msg) not in folded_ids and msg.get("role") != "summary"]
+        system = [msg for msg in remaining if msg.get("role") == "system"]
+        dialog_messages = [msg for msg in remaining if msg.get("role") != "system"]
+        history[:] = system + [{"role": "summary", "content": text}] + dialog_messages
+
+        _, kept = split_summary(dialog_messages)
+        history_writer.append_summary(chat_id, text, len(kept))
+        logger.info(f"🗜️ История чата {chat_id} сжата: {len(folded)} пар в сводке, {len(kept)} осталось")
+
+    async def close(self):
+        """Отменить незавершенные сжатия"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Глобальный экземпляр фонового сжатия истории
+summarizer = ConversationSummarizer()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# config.Settings проверяет обязательные переменные при импорте
+os.environ.setdefault("BOT_TOKEN", "1234567890:test")
+os.environ.setdefault("YA_API_KEY", "test-api-key")
+os.environ.setdefault("YA_FOLDER_ID", "test-folder")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
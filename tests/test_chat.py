@@ -0,0 +1,130 @@
+import asyncio
+import json
+from bot.handlers import chat as chat_handler
+from bot.handlers.chat import TELEGRAM_MESSAGE_LIMIT, split_message, stream_reply
+
+class FakeMessage:
+    def __init__(self, sent: list, text: str = ""):
+        self.sent = sent
+        self.text = text
+
+    async def reply_text(self, text: str, **kwargs):
+        message = FakeMessage(self.sent, text)
+        self.sent.append(message)
+        return message
+
+    async def edit_text(self, text: str, **kwargs):
+        self.text = text
+
+class FakeUpdate:
+    def __init__(self):
+        self.sent = []
+        self.message = FakeMessage(self.sent)
+
+def test_split_message_keeps_short_text():
+    assert split_message("Короткий ответ") == ["Короткий ответ"]
+
+def test_split_message_cuts_at_line_breaks():
+    paragraph = "слово " * 500
+    text = "\n".join([paragraph.strip()] * 3)
+    parts = split_message(text)
+    assert len(parts) == 3
+    assert all(len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert "\n".join(parts) == text
+
+def test_split_message_cuts_long_words():
+    parts = split_message("я" * (TELEGRAM_MESSAGE_LIMIT + 10))
+    assert [len(part) for part in parts] == [TELEGRAM_MESSAGE_LIMIT, 10]
+
+def test_stream_reply_sends_the_rest_of_a_long_answer(monkeypatch):
+    monkeypatch.setattr(chat_handler.settings, "stream_edit_interval", 0)
+    answer = "\n".join([("строка ответа " * 20).strip()] * 40)
+    assert len(answer) > TELEGRAM_MESSAGE_LIMIT
+
+    async def chunks():
+        yield answer[:100]
+        yield answer
+
+    update = FakeUpdate()
+    assert asyncio.run(stream_reply(update, chunks())) == answer
+    assert "\n".join(message.text for message in update.sent) == answer
+    assert all(len(message.text) <= TELEGRAM_MESSAGE_LIMIT for message in update.sent)
+
+class FakePrompt:
+    text = "Системный промпт"
+    version = "1"
+
+class FakeAPIClient:
+    background_breaker = None
+    queue_depth = 0
+
+    def __init__(self):
+        self.summary_requests = 0
+
+    async def make_request(self, messages, **kwargs):
+        self.summary_requests += 1
+        return "Клиент спрашивал об участках."
+
+class FakeLLMService:
+    def __init__(self):
+        self.api_client = FakeAPIClient()
+
+    def determine_intent(self, user_message, previous_intent=None):
+        return "general"
+
+    def get_prompt(self, prompt_type):
+        return FakePrompt()
+
+    async def chat(self, user_message, history, prompt_type, user_key=None):
+        return f"Ответ на «{user_message}»"
+
+class FakeApplication:
+    update_processor = None
+
+    def __init__(self, llm_service):
+        self.bot_data = {"llm_service": llm_service}
+
+class FakeContext:
+    def __init__(self, llm_service):
+        self.application = FakeApplication(llm_service)
+        self.chat_data = {}
+        self.user_data = {}
+
+class FakeChat:
+    id = 42
+
+def test_long_dialog_is_summarized(tmp_path, monkeypatch):
+    from services import history
+    from services.history import HistoryWriter
+    from services.summarizer import summarizer
+
+    settings = chat_handler.settings
+    monkeypatch.setattr(settings, "history_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "use_cache", False)
+    monkeypatch.setattr(settings, "llm_streaming", False)
+    monkeypatch.setattr(settings, "summary_enabled", True)
+    assert settings.summary_keep_pairs < settings.summary_trigger_pairs < settings.max_history_pairs
+    writer = HistoryWriter(flush_interval=3600)
+    monkeypatch.setattr(history, "history_writer", writer)
+    monkeypatch.setattr(chat_handler, "history_writer", writer)
+    monkeypatch.setattr("services.summarizer.history_writer", writer)
+
+    llm_service = FakeLLMService()
+    context = FakeContext(llm_service)
+
+    async def scenario():
+        for i in range(settings.summary_trigger_pairs + 3):
+            update = FakeUpdate()
+            update.effective_chat = FakeChat()
+            update.message.text = f"Вопрос {i}"
+            await chat_handler._chat(update, context)
+            # Сжатие идет в фоне: даем ему завершиться
+            await asyncio.sleep(0)
+        await writer.close()
+
+    asyncio.run(scenario())
+    records = [json.loads(line) for line in (tmp_path / "chat_42.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert llm_service.api_client.summary_requests >= 1
+    assert any("s" in record for record in records)
+    roles = [msg["role"] for msg in context.chat_data["history"]]
+    assert roles.count("summary") == 1
@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+from config import settings
+from services import history
+from services.history import HistoryWriter
+
+@pytest.fixture
+def history_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "history_dir", str(tmp_path))
+    return tmp_path
+
+def test_load_history_sees_records_flushed_during_read(history_dir, monkeypatch):
+    writer = HistoryWriter(flush_interval=3600)
+    monkeypatch.setattr(history, "history_writer", writer)
+    read_tail = history._read_tail
+
+    async def slow_read_tail(path, max_records):
+        records = await read_tail(path, max_records)
+        # Дозапись успевает забрать записи из буфера, пока хвост уже прочитан
+        await asyncio.sleep(0.05)
+        return records
+
+    monkeypatch.setattr(history, "_read_tail", slow_read_tail)
+
+    async def scenario():
+        writer.append_turn(1, "первый", "ответ 1")
+        await writer.flush()
+        writer.append_turn(1, "второй", "ответ 2")
+        load = asyncio.create_task(history.load_history(1, 10))
+        await asyncio.sleep(0.01)
+        await writer.flush()
+        messages = await load
+        await writer.close()
+        return messages
+
+    messages = asyncio.run(scenario())
+    assert [msg["content"] for msg in messages if msg["role"] == "user"] == ["первый", "второй"]
@@ -0,0 +1,21 @@
+from services.intent_recognizer import IntentRecognizer
+
+class UnsureClassifier:
+    intents = ("buyer", "investor", "partner", "general")
+
+    def predict(self, text):
+        return "buyer", 0.3
+
+def _recognizer(tmp_path) -> IntentRecognizer:
+    # Без prompt_map.json используется встроенный словарь ключевых слов
+    recognizer = IntentRecognizer(str(tmp_path))
+    recognizer.classifier = UnsureClassifier()
+    return recognizer
+
+def test_keyword_overrides_previous_intent_when_model_is_unsure(tmp_path):
+    result = _recognizer(tmp_path).classify("Хочу инвестировать", previous_intent="buyer")
+    assert (result.intent, result.source) == ("investor", "keywords")
+
+def test_previous_intent_kept_without_keywords(tmp_path):
+    result = _recognizer(tmp_path).classify("А по срокам?", previous_intent="investor")
+    assert (result.intent, result.source) == ("investor", "previous")
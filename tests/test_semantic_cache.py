@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from services.semantic_cache import HashingEmbedder, SemanticCache, np, question_numbers
+
+pytestmark = pytest.mark.skipif(np is None, reason="numpy не установлен")
+
+ANSWER = "Участок 10 соток стоит 1 млн рублей."
+
+def _cache_with(question: str) -> SemanticCache:
+    cache = SemanticCache(HashingEmbedder())
+    cache.enabled = True
+    cache.add("buyer", question, asyncio.run(cache.embed(question)), ANSWER)
+    return cache
+
+def _lookup(cache: SemanticCache, question: str):
+    return cache.lookup("buyer", question, asyncio.run(cache.embed(question)))
+
+def test_question_numbers():
+    assert question_numbers("Участок 1,5 га или 20 соток?") == ("1.5", "20")
+    assert question_numbers("Сколько стоит участок?") == ()
+
+def test_paraphrase_with_same_numbers_hits():
+    cache = _cache_with("Сколько стоит участок 10 соток")
+    assert _lookup(cache, "Сколько стоит участок 10 соток?") == ANSWER
+
+def test_paraphrase_with_other_numbers_misses():
+    cache = _cache_with("Сколько стоит участок 10 соток")
+    question = "Сколько стоит участок 20 соток"
+    # Эмбеддинги почти совпадают, отличие только в числе
+    assert float(asyncio.run(cache.embed(question)) @ asyncio.run(cache.embed("Сколько стоит участок 10 соток"))) >= cache.threshold
+    assert _lookup(cache, question) is None
+    assert _lookup(cache, "Сколько стоит участок соток") is None
+    assert cache.stats()["hits"] == 0
+
+def test_add_keeps_questions_with_other_numbers_apart():
+    cache = _cache_with("Сколько стоит участок 10 соток")
+    other = "Сколько стоит участок 20 соток"
+    cache.add("buyer", other, asyncio.run(cache.embed(other)), "Участок 20 соток стоит 2 млн рублей.")
+    assert cache.stats()["entries"] == 2
+    assert _lookup(cache, other) == "Участок 20 соток стоит 2 млн рублей."
+    assert _lookup(cache, "Сколько стоит участок 10 соток") == ANSWER
@@ -0,0 +1,90 @@
+import os
+import re
+import json
+import glob
+from collections import Counter
+from config import settings
+from services.intent_classifier import IntentClassifier, np
+from services.intent_recognizer import IntentRecognizer
+
+# Строка лога обработчика чата: "... - Получено сообщение: текст"
+LOG_MESSAGE_RE = re.compile(r" - Получено сообщение: (.+)$")
+
+def load_prompts(recognizer: IntentRecognizer) -> dict:
+    """Текст системного промпта -> интент, чтобы разметить историю старого формата"""
+    prompts = {}
+    for intent in recognizer.prompt_map:
+        path = os.path.join(settings.prompts_dir, f"{intent}.txt")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                prompts[f.read().strip()] = intent
+    return prompts
+
+def history_samples(recognizer: IntentRecognizer):
+    """Вопросы из истории чатов; интент — id промпта, с которым на них ответили"""
+    for path in glob.glob(os.path.join(settings.history_dir, "chat_*.jsonl")):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("u") and record.get("p") in recognizer.prompt_map:
+                    yield record["u"], record["p"]
+
+    # Старый формат: список сообщений, интент определяется по тексту системного промпта
+    prompts = load_prompts(recognizer)
+    for path in glob.glob(os.path.join(settings.history_dir, "chat_*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                history = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        intent = None
+        for msg in history:
+            if msg.get("role") == "system":
+                intent = prompts.get(msg.get("content", "").strip())
+            elif msg.get("role") == "user" and intent:
+                yield msg.get("content", ""), intent
+
+def log_samples(recognizer: IntentRecognizer):
+    """Сообщения из логов, размеченные ключевыми словами (только однозначные совпадения)"""
+    for path in glob.glob(os.path.join(settings.logs_dir, "*.log")):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                match = LOG_MESSAGE_RE.search(line.rstrip("\n"))
+                if not match:
+                    continue
+                result = recognizer.classify(match.group(1))
+                if result.source == "keywords" and result.confidence == 1.0:
+                    yield match.group(1), result.intent
+
+def keyword_samples(recognizer: IntentRecognizer):
+    """Ключевые слова prompt_map.json — минимальный пример каждого интента"""
+    for intent, keywords in recognizer.prompt_map.items():
+        for keyword in keywords:
+            yield keyword, intent
+
+def train():
+    if np is None:
+        print("❌ Для обучения нужен numpy: pip install numpy")
+        return
+
+    # Разметка по ключевым словам не должна зависеть от старой модели
+    settings.intent_classifier_enabled = False
+    recognizer = IntentRecognizer(settings.prompts_dir)
+
+    samples = list(history_samples(recognizer)) + list(log_samples(recognizer)) + list(keyword_samples(recognizer))
+    print(f"📚 Примеров для обучения: {len(samples)}")
+    for intent, count in sorted(Counter(intent for _, intent in samples).items()):
+        print(f"   {intent}: {count}")
+
+    classifier = IntentClassifier.train(samples)
+    correct = sum(1 for text, intent in samples if classifier.predict(text)[0] == intent)
+    print(f"🎯 Точность на обучающих примерах: {correct / len(samples):.1%}")
+
+    classifier.save(settings.intent_model_file)
+    print(f"✅ Модель сохранена: {settings.intent_model_file}")
+
+if __name__ == "__main__":
+    train()
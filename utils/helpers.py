@@ -1,11 +1,13 @@
 import hashlib
 import json
-from typing import List, Dict
+import re
+from typing import List, Dict, Optional
 
-def get_cache_key(user_message: str, history: List[Dict]) -> str:
+def get_cache_key(user_message: str, history: List[Dict], prompt_version: Optional[str] = None) -> str:
     """
     Генерирует ключ кэша на основе пользовательского сообщения и истории.
     Учитывает только последние несколько сообщений для эффективности.
+    Если передана версия промпта, вместо текста системного промпта хэшируется она.
     """
     if not user_message:
         return None
@@ -13,7 +15,10 @@ def get_cache_key(user_message: str, history: List[Dict]) -> str:
     # Ограничиваем историю для ключа кэша (последние 3 пары вопрос-ответ + системный промпт)
     max_history_for_cache = 3 * 2 + 1  # 3 пары + системный промпт
     
-    if len(history) > max_history_for_cache:
+    if prompt_version is not None:
+        dialog = [msg for msg in history if msg.get("role") != "system"]
+        relevant_history = [{"role": "system", "version": prompt_version}] + dialog[-max_history_for_cache+1:]
+    elif len(history) > max_history_for_cache:
         relevant_history = history[:1] + history[-max_history_for_cache+1:]
     else:
         relevant_history = history
@@ -28,6 +33,68 @@ def get_cache_key(user_message: str, history: List[Dict]) -> str:
     json_str = json.dumps(data_to_hash, sort_keys=True, ensure_ascii=False)
     return hashlib.md5(json_str.encode('utf-8')).hexdigest()
 
+# Служебные слова, не влияющие на смысл вопроса
+RU_STOP_WORDS = frozenset({
+    "а", "без", "бы", "был", "была", "были", "было", "быть", "в", "вам", "вас", "ваш",
+    "во", "вот", "вы", "да", "для", "до", "его", "ее", "её", "если", "есть", "же", "за",
+    "и", "из", "или", "им", "их", "к", "как", "ко", "ли", "мне", "мы", "на", "над",
+    "ну", "о", "об", "от", "по", "под", "пожалуйста", "при", "про", "с",
+    "со", "так", "также", "то", "у", "уже", "чем", "что", "чтобы", "это", "я",
+    "подскажите", "скажите", "здравствуйте", "привет", "добрый", "день",
+    "какой", "какая", "какое", "какие", "какую", "каков", "какова", "каково", "каковы",
+})
+
+# Слова, по которым видно, что вопрос опирается на предыдущий контекст
+CONTEXT_MARKERS = frozenset({
+    "это", "этот", "эта", "эти", "этого", "этом", "он", "она", "оно", "они", "его", "ее",
+    "её", "их", "там", "тогда", "тоже", "еще", "ещё", "подробнее", "почему", "такой",
+    "такие", "тот", "та", "те", "выше",
+})
+
+# Окончания для упрощенного стемминга, от длинных к коротким
+RU_SUFFIXES = tuple(sorted({
+    "остью", "ости", "ость", "иями", "ии", "ями", "ами", "ией", "иям", "ием", "иях", "ого", "его", "ому", "ему",
+    "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ом",
+    "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ию", "ия", "ие", "ий", "ть", "ться",
+    "ет", "ит", "ут", "ют", "ат", "ят", "ешь", "ишь", "ок", "ек", "ки", "ка", "ку",
+    "ке", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+}, key=len, reverse=True))
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+
+def stem_ru(word: str) -> str:
+    """Упрощенный стемминг: отрезает типичное окончание, оставляя основу не короче 3 букв"""
+    word = word.replace("ё", "е")
+    for suffix in RU_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на слова в нижнем регистре без знаков препинания"""
+    return _WORD_RE.findall(text.lower())
+
+def normalize_question(text: str) -> str:
+    """
+    Приводит вопрос к канонической форме: нижний регистр, без пунктуации
+    и стоп-слов, слова заменены основами и отсортированы.
+    """
+    stems = {stem_ru(word) for word in tokenize(text) if word not in RU_STOP_WORDS}
+    return " ".join(sorted(stems))
+
+def is_context_free(user_message: str, history: List[Dict]) -> bool:
+    """Вопрос задан первым в диалоге или не ссылается на предыдущие сообщения"""
+    if not any(msg.get("role") == "user" for msg in history):
+        return True
+    return not any(word in CONTEXT_MARKERS for word in tokenize(user_message))
+
+def get_faq_cache_key(user_message: str, intent: str) -> Optional[str]:
+    """Ключ FAQ-кэша: интент и нормализованный вопрос, без учета истории диалога"""
+    normalized = normalize_question(user_message)
+    if not normalized:
+        return None
+    return hashlib.md5(f"{intent}:{normalized}".encode('utf-8')).hexdigest()
+
 def format_file_size(size_bytes: int) -> str:
     """Форматирует размер файла в читаемом виде"""
     if size_bytes == 0: